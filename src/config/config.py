@@ -13,6 +13,100 @@ class Config:
             "password": os.getenv("DB_PASSWORD"),
             "database": os.getenv("DB_NAME")
         }
+        self.db_pool_config = {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+            "acquire_timeout": float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 5)),
+            "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", 5)),
+            "statement_timeout": int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 5000))
+        }
+        self.migrate_on_start = os.getenv("DB_MIGRATE_ON_START", "true").lower() in ("1", "true", "yes")
+        self.user_cache_config = {
+            "max_size": int(os.getenv("USER_CACHE_SIZE", 10000)),
+            "ttl": float(os.getenv("USER_CACHE_TTL", 60))
+        }
+        self.fsm_storage = os.getenv("FSM_STORAGE", "postgres")
+        self.redis_url = os.getenv("REDIS_URL")
+        self.fsm_ttl_config = {
+            "default_ttl": float(os.getenv("FSM_STATE_TTL", 86400)),
+            "state_ttls": {
+                "PaymentStates:waiting_for_payment": float(os.getenv("FSM_PAYMENT_TTL", 3600)),
+                "PaymentStates:waiting_for_api_key": float(os.getenv("FSM_API_KEY_TTL", 1800))
+            },
+            "sweep_interval": float(os.getenv("FSM_SWEEP_INTERVAL", 300))
+        }
+        self.username_flush_interval = float(os.getenv("USERNAME_FLUSH_INTERVAL", 30))
+        self.crypto_config = {
+            "api_url": os.getenv("CRYPTO_PAY_API_URL", "https://pay.crypt.bot/api"),
+            "connect_timeout": float(os.getenv("CRYPTO_CONNECT_TIMEOUT", 3)),
+            "read_timeout": float(os.getenv("CRYPTO_READ_TIMEOUT", 10)),
+            "max_connections": int(os.getenv("CRYPTO_MAX_CONNECTIONS", 20)),
+            "max_concurrency": int(os.getenv("CRYPTO_MAX_CONCURRENCY", 10)),
+            "retries": int(os.getenv("CRYPTO_RETRIES", 3)),
+            "status_ttl": float(os.getenv("CRYPTO_STATUS_TTL", 3)),
+            "status_cache_size": int(os.getenv("CRYPTO_STATUS_CACHE_SIZE", 10000)),
+            "breaker_failures": int(os.getenv("CRYPTO_BREAKER_FAILURES", 5)),
+            "breaker_reset_timeout": float(os.getenv("CRYPTO_BREAKER_RESET_TIMEOUT", 30)),
+            "breaker_half_open_calls": int(os.getenv("CRYPTO_BREAKER_HALF_OPEN_CALLS", 1))
+        }
+        self.http_host = os.getenv("HTTP_HOST", "0.0.0.0")
+        self.http_port = int(os.getenv("HTTP_PORT", 8080))
+        self.crypto_webhook_path = os.getenv("CRYPTO_WEBHOOK_PATH")
+        self.log_config = {
+            "level": os.getenv("LOG_LEVEL", "INFO").upper(),
+            "json_output": os.getenv("LOG_FORMAT", "text").lower() == "json",
+            "sample_rate": float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+        }
+        self.metrics_path = os.getenv("METRICS_PATH", "/metrics")
+        self.loop_lag_interval = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))
+        self.bot_mode = os.getenv("BOT_MODE", "polling")
+        self.telegram_webhook_url = os.getenv("TELEGRAM_WEBHOOK_URL")
+        self.telegram_webhook_path = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram")
+        self.telegram_webhook_config = {
+            "secret_token": os.getenv("TELEGRAM_WEBHOOK_SECRET"),
+            "queue_size": int(os.getenv("TELEGRAM_WEBHOOK_QUEUE_SIZE", 1000)),
+            "workers": int(os.getenv("TELEGRAM_WEBHOOK_WORKERS", 50)),
+            "enqueue_timeout": float(os.getenv("TELEGRAM_WEBHOOK_ENQUEUE_TIMEOUT", 1))
+        }
+        self.tariffs_path = os.getenv("TARIFFS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tariffs.json"))
+        self.invoice_config = {
+            "invoice_ttl": int(os.getenv("INVOICE_TTL", 3600)),
+            "invoice_reuse_margin": int(os.getenv("INVOICE_REUSE_MARGIN", 300))
+        }
+        self.reconciler_config = {
+            "batch_size": int(os.getenv("RECONCILE_BATCH_SIZE", 100)),
+            "interval": float(os.getenv("RECONCILE_INTERVAL", 60))
+        }
+        self.expiry_config = {
+            "min_sleep": float(os.getenv("EXPIRY_MIN_SLEEP", 1)),
+            "max_sleep": float(os.getenv("EXPIRY_MAX_SLEEP", 3600))
+        }
+        self.throttle_config = {
+            "user_rate": float(os.getenv("THROTTLE_USER_RATE", 2)),
+            "user_burst": float(os.getenv("THROTTLE_USER_BURST", 5)),
+            "prefix_limits": {
+                "tariff:": (float(os.getenv("THROTTLE_TARIFF_RATE", 0.2)),
+                            float(os.getenv("THROTTLE_TARIFF_BURST", 3))),
+                "check_payment:": (float(os.getenv("THROTTLE_CHECK_PAYMENT_RATE", 0.2)),
+                                   float(os.getenv("THROTTLE_CHECK_PAYMENT_BURST", 3)))
+            },
+            "max_keys": int(os.getenv("THROTTLE_MAX_KEYS", 100000))
+        }
+        self.notifier_config = {
+            "global_rate": float(os.getenv("TELEGRAM_GLOBAL_RATE", 25)),
+            "per_chat_rate": float(os.getenv("TELEGRAM_PER_CHAT_RATE", 1)),
+            # Ответ на одно нажатие — до трёх сообщений подряд; дальше не чаще per_chat_rate.
+            "per_chat_burst": float(os.getenv("TELEGRAM_PER_CHAT_BURST", 3))
+        }
+        self.outbox_config = {
+            "workers": int(os.getenv("OUTBOX_WORKERS", 20)),
+            "queue_size": int(os.getenv("OUTBOX_QUEUE_SIZE", 10000)),
+            "batch_size": int(os.getenv("OUTBOX_BATCH_SIZE", 100)),
+            "poll_interval": float(os.getenv("OUTBOX_POLL_INTERVAL", 5)),
+            "lease": float(os.getenv("OUTBOX_LEASE", 60)),
+            "max_attempts": int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10)),
+            "retry_delay": float(os.getenv("OUTBOX_RETRY_DELAY", 5))
+        }
 
     def validate(self):
         if not all([
@@ -25,5 +119,13 @@ class Config:
             self.db_config["database"]
         ]):
             raise ValueError("Не все переменные окружения заданы")
+        if self.fsm_storage not in ("memory", "postgres", "redis"):
+            raise ValueError(f"Неизвестный FSM_STORAGE: {self.fsm_storage}")
+        if self.fsm_storage == "redis" and not self.redis_url:
+            raise ValueError("Для FSM_STORAGE=redis нужен REDIS_URL")
+        if self.bot_mode not in ("polling", "webhook"):
+            raise ValueError(f"Неизвестный BOT_MODE: {self.bot_mode}")
+        if self.bot_mode == "webhook" and not (self.telegram_webhook_url and self.telegram_webhook_config["secret_token"]):
+            raise ValueError("Для BOT_MODE=webhook нужны TELEGRAM_WEBHOOK_URL и TELEGRAM_WEBHOOK_SECRET")
 
 config = Config()
\ No newline at end of file
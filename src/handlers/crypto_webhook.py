@@ -0,0 +1,55 @@
+import hashlib
+import hmac
+import json
+from aiohttp import web
+from services.bot_service import BotService
+from logger.logger import Logger
+
+class CryptoPayWebhook:
+    def __init__(self, bot_service: BotService, token: str, logger: Logger):
+        self.bot_service = bot_service
+        self.logger = logger
+        # Crypto Pay подписывает тело запроса HMAC-SHA-256 с ключом SHA-256(token).
+        self.secret = hashlib.sha256(token.encode()).digest()
+
+    def verify(self, body: bytes, signature: str) -> bool:
+        expected = hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature or "")
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_post(path, self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not self.verify(body, request.headers.get("crypto-pay-api-signature")):
+            self.logger.error("Вебхук Crypto Pay с неверной подписью отклонён")
+            raise web.HTTPUnauthorized()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            self.logger.error("Вебхук Crypto Pay с телом не в JSON отклонён")
+            raise web.HTTPBadRequest()
+        if not isinstance(update, dict):
+            self.logger.error("Вебхук Crypto Pay с некорректным телом отклонён")
+            raise web.HTTPBadRequest()
+        if update.get("update_type") != "invoice_paid":
+            return web.json_response({"ok": True})
+
+        invoice = update.get("payload")
+        if not isinstance(invoice, dict):
+            self.logger.error("Вебхук Crypto Pay без инвойса отклонён")
+            raise web.HTTPBadRequest()
+        # Подписанный вебхук — самый свежий статус: проверка кнопкой сразу увидит оплату.
+        self.bot_service.crypto_service.remember_invoice(invoice)
+        self.logger.info("Вебхук Crypto Pay: оплачен инвойс %s", invoice.get('invoice_id'))
+        try:
+            await self.bot_service.confirm_invoice(invoice)
+        except ValueError as e:
+            # Повтор доставки ничего не исправит — подтверждаем получение и оставляем след в логах.
+            self.logger.error("Не удалось применить инвойс %s: %s", invoice.get('invoice_id'), e)
+            return web.json_response({"ok": True})
+        except Exception as e:
+            self.logger.error("Ошибка обработки вебхука Crypto Pay: %s", e)
+            raise web.HTTPInternalServerError()
+
+        return web.json_response({"ok": True})
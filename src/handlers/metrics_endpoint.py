@@ -0,0 +1,14 @@
+from aiohttp import web
+from metrics.metrics import Registry, REGISTRY
+
+class MetricsEndpoint:
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_get(path, self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode(), headers={"Content-Type": self.CONTENT_TYPE})
@@ -0,0 +1,133 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import CallbackQuery, TelegramObject
+from repositories.db import Repository
+from repositories.username_buffer import UsernameBuffer
+from services.rate_limiter import KeyedTokenBuckets
+from metrics.metrics import REGISTRY
+from logger.logger import Logger
+
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_duration_seconds", "Время обработки обновления", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Необработанные исключения в обработчиках", ("handler",))
+TELEGRAM_SECONDS = REGISTRY.histogram(
+    "telegram_api_duration_seconds", "Время запросов к Bot API", ("method", "status")
+)
+THROTTLED = REGISTRY.counter("bot_throttled_total", "Обновления, отброшенные ограничителем частоты", ("scope",))
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    NOTICE = "Слишком часто. Подождите несколько секунд и попробуйте снова."
+
+    def __init__(self, user_rate: float = 2.0, user_burst: float = 5.0,
+                 prefix_limits: dict[str, tuple[float, float]] = None, max_keys: int = 100000):
+        # Ведра хранятся для max_keys самых недавних пользователей; вытесненный пользователь
+        # начинает с полного ведра, что безопасно, пока max_keys больше числа активных.
+        self.user_buckets = KeyedTokenBuckets(user_rate, user_burst, max_keys)
+        self.prefix_buckets = {
+            prefix: KeyedTokenBuckets(rate, burst, max_keys)
+            for prefix, (rate, burst) in (prefix_limits or {}).items()
+        }
+
+    def _scope(self, event: TelegramObject, user_id: int) -> str:
+        if isinstance(event, CallbackQuery) and event.data:
+            for prefix, buckets in self.prefix_buckets.items():
+                if event.data.startswith(prefix):
+                    # Ведро по префиксу проверяется первым: дорогая кнопка не расходует общий лимит.
+                    return None if buckets.try_consume(user_id) else prefix
+        return None if self.user_buckets.try_consume(user_id) else "user"
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is None:
+            return await handler(event, data)
+        scope = self._scope(event, from_user.id)
+        if scope is None:
+            return await handler(event, data)
+        THROTTLED.inc(scope)
+        if isinstance(event, CallbackQuery):
+            # Ответ на callback убирает «часики» на кнопке; ни базы, ни Crypto Pay он не трогает.
+            await event.answer(self.NOTICE)
+        return None
+
+
+class MetricsMiddleware(BaseMiddleware):
+    # Подключается первым из внутренних middleware, поэтому время включает загрузку
+    # пользователя; сколько из него заняла база, видно по db_query_duration_seconds.
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            status = "retry_after"
+            raise
+        except TelegramAPIError as e:
+            status = type(e).__name__
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, type(method).__name__, status)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    def __init__(self, repo: Repository, username_buffer: UsernameBuffer, logger: Logger):
+        self.repo = repo
+        self.username_buffer = username_buffer
+        self.logger = logger
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is not None:
+            try:
+                user = await self.repo.get_user(from_user.id)
+                if user is None:
+                    user = await self.repo.touch_user(from_user.id, from_user.username)
+                else:
+                    self.username_buffer.refresh(user, from_user.username)
+                data["user"] = user
+            except Exception as e:
+                self.logger.error("Ошибка загрузки пользователя %s: %s", from_user.id, e)
+                await event.answer("Ошибка при загрузке профиля. Попробуйте позже.")
+                return None
+        return await handler(event, data)
@@ -0,0 +1,30 @@
+from typing import Union
+from aiogram import types
+from models.response import Response
+from services.outbox import Outbox
+
+class ResponseRenderer:
+    # Нажатие кнопки — одна правка сообщения с кнопкой и обязательный answerCallbackQuery,
+    # в который попадает уведомление; ошибки и «оплата ещё не пришла» — только уведомление,
+    # экран остаётся прежним. На текстовое сообщение — один новый ответ.
+    # Экраны уходят через outbox: по порядку для чата и с лимитами Telegram.
+
+    def __init__(self, outbox: Outbox):
+        self.outbox = outbox
+
+    async def render(self, event: Union[types.CallbackQuery, types.Message], response: Response):
+        if isinstance(event, types.CallbackQuery):
+            if response.text is not None:
+                await self.outbox.send(
+                    event.message.chat.id,
+                    response.text,
+                    # Если править уже нельзя (сообщение удалено или устарело), Notifier отправит новое.
+                    edit_message_id=event.message.message_id,
+                    parse_mode="HTML",
+                    reply_markup=response.reply_markup
+                )
+            await event.answer(response.notice, show_alert=response.notice is not None)
+            return
+        text = response.text if response.text is not None else response.notice
+        if text is not None:
+            await self.outbox.send(event.chat.id, text, parse_mode="HTML", reply_markup=response.reply_markup)
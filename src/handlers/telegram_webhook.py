@@ -0,0 +1,66 @@
+import asyncio
+import hmac
+import json
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from pydantic import ValidationError
+from logger.logger import Logger
+
+class TelegramWebhook:
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, logger: Logger, secret_token: str,
+                 queue_size: int = 1000, workers: int = 50, enqueue_timeout: float = 1.0):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.logger = logger
+        self.secret_token = secret_token
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self.tasks = []
+        self.stats = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0}
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_post(path, self.handle)
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, self.secret_token):
+            raise web.HTTPUnauthorized()
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except (json.JSONDecodeError, ValidationError) as e:
+            # Повтор такого тела ничего не исправит: отвечаем 400, а не 500 из глубины aiohttp.
+            self.logger.error("Некорректное обновление Telegram отклонено: %s", e)
+            raise web.HTTPBadRequest()
+        try:
+            await asyncio.wait_for(self.queue.put(update), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            # Очередь полна дольше допустимого: отвечаем ошибкой, и Telegram доставит
+            # обновление повторно позже, вместо того чтобы копить его в памяти.
+            self.stats["rejected"] += 1
+            self.logger.error("Очередь обновлений переполнена, update %s отклонён", update.update_id)
+            raise web.HTTPServiceUnavailable()
+        self.stats["accepted"] += 1
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                self.logger.error("Ошибка обработки update %s: %s", update.update_id, e)
+            finally:
+                self.queue.task_done()
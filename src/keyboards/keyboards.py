@@ -0,0 +1,60 @@
+from aiogram import types
+from models.user import User
+from services.tariff_catalog import TariffCatalog
+
+# Клавиатуры строятся один раз и раздаются всем обработчикам общими экземплярами,
+# поэтому изменять их (append и т.п.) нельзя — нужен новый вариант, добавьте его здесь.
+
+def button(text: str, callback_data: str) -> types.InlineKeyboardButton:
+    return types.InlineKeyboardButton(text=text, callback_data=callback_data)
+
+
+def markup(*rows: list[types.InlineKeyboardButton]) -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup(inline_keyboard=list(rows))
+
+
+class KeyboardRegistry:
+    def __init__(self, tariffs: TariffCatalog, exchanges: list[str]):
+        main_menu = button("🏠 Главное меню", "main_menu")
+        support = button("📞 Поддержка", "support")
+        footer = [support, main_menu]
+        exchange_row = [button(exchange, f"exchange:{exchange}") for exchange in exchanges]
+
+        self.main_menu = markup([main_menu])
+        self.subscription_types = markup(
+            [
+                button("Обычная подписка", "subscription_type:regular"),
+                button("Реферальная подписка", "subscription_type:referral")
+            ],
+            footer
+        )
+        self.exchanges = markup(*([exchange] for exchange in exchange_row), footer)
+        profile_row = [support, button("💳 Продлить подписку", "extend_subscription")]
+        self.profiles = {
+            False: markup(profile_row),
+            True: markup(profile_row, exchange_row)
+        }
+        self.tariff_menus = {
+            subscription_type: markup(
+                *([button(f"{tariff.name} - {tariff.price}$", f"tariff:{tariff.tariff_id}")]
+                  for tariff in tariffs.items(subscription_type)),
+                footer
+            )
+            for subscription_type in tariffs.subscription_types
+        }
+        tariff_ids = {tariff_id for _, tariff_id in tariffs.by_id}
+        self.payment_checks = {
+            tariff_id: markup([button("✅ Проверить оплату", f"check_payment:{tariff_id}")], [main_menu])
+            for tariff_id in tariff_ids
+        }
+
+    def profile(self, user: User) -> types.InlineKeyboardMarkup:
+        # Выбор биржи прямо в профиле предлагается тем, кто уже выбрал тип подписки, но не биржу.
+        return self.profiles[bool(user and user.subscription_type and not user.exchange)]
+
+    def tariffs(self, user: User) -> types.InlineKeyboardMarkup:
+        subscription_type = user.subscription_type if user and user.subscription_type else "regular"
+        return self.tariff_menus[subscription_type]
+
+    def payment_check(self, tariff_id: str) -> types.InlineKeyboardMarkup:
+        return self.payment_checks[tariff_id]
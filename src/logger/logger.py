@@ -1,18 +1,95 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
+import re
+
+# Маскируются значения после api_key=/token=/secret=/password= и токены вида 123456:ABC...
+# (Telegram Bot API, в том числе внутри URL): такие строки не должны попадать в логи
+# даже из сообщений исключений сторонних библиотек.
+SECRET_PATTERNS = [
+    (re.compile(r"(?i)\b(api[_-]?key|token|secret|password)(\s*[=:]\s*)([^\s,;&)]+)"), r"\1\2***"),
+    (re.compile(r"(?<!\d)\d{6,}:[A-Za-z0-9_-]{30,}"), "***")
+]
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage())
+        }
+        if record.exc_info:
+            entry["exception"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    # Стандартный QueueHandler форматирует запись ещё в потоке event loop; здесь запись
+    # уходит в очередь как есть, и подстановка аргументов делается в потоке слушателя.
+    # Поэтому аргументами должны быть неизменяемые значения (числа, строки, исключения).
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
 
 class Logger:
-    def __init__(self):
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.StreamHandler()
-            ]
-        )
+    FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+    listener = None
+
+    def __init__(self, level: str = "INFO", json_output: bool = False, sample_rate: float = 1.0):
         self.logger = logging.getLogger(__name__)
+        self.sample_rate = sample_rate
+        if Logger.listener is None:
+            # Запись в поток вывода — в отдельном потоке: обработчики на event loop только
+            # кладут запись в очередь. Настраивается один раз на процесс.
+            handler = logging.StreamHandler()
+            handler.setFormatter(JsonFormatter() if json_output else RedactingFormatter(self.FORMAT))
+            records = queue.SimpleQueue()
+            root = logging.getLogger()
+            root.handlers = [LazyQueueHandler(records)]
+            root.setLevel(level)
+            # Формат не использует имя файла, поток и процесс — не собираем их для каждой записи
+            # (обход стека в findCaller — самая дорогая часть makeRecord).
+            logging._srcfile = None
+            logging.logThreads = False
+            logging.logProcesses = False
+            logging.logMultiprocessing = False
+            Logger.listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+            Logger.listener.start()
+            atexit.register(Logger.shutdown)
+
+    @classmethod
+    def shutdown(cls):
+        # Дописывает всё, что осталось в очереди; после этого записи снова копятся до start().
+        if cls.listener is not None and cls.listener._thread is not None:
+            cls.listener.stop()
+
+    def debug(self, msg, *args):
+        self.logger.debug(msg, *args)
 
     def info(self, msg, *args):
         self.logger.info(msg, *args)
-    
+
+    def sample(self, msg, *args):
+        # Частые строки (по одной на каждое обновление) пишутся с вероятностью sample_rate.
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            self.logger.info(msg, *args)
+
     def error(self, msg, *args):
-        self.logger.error(msg, *args)
\ No newline at end of file
+        self.logger.error(msg, *args)
@@ -1,34 +1,145 @@
 import asyncio
+import signal
+from aiohttp import web
 from config.config import Config
 from logger.logger import Logger
 from handlers.bot import Handler
+from handlers.crypto_webhook import CryptoPayWebhook
+from handlers.metrics_endpoint import MetricsEndpoint
+from handlers.middlewares import ThrottlingMiddleware
+from handlers.telegram_webhook import TelegramWebhook
 from services.bot_service import BotService
 from services.crypto_service import CryptoService
+from services.expiry_scheduler import ExpiryScheduler
+from services.notifier import Notifier
+from services.outbox import Outbox
+from services.invoice_reconciler import InvoiceReconciler
+from services.tariff_catalog import TariffCatalog
 from repositories.db import Repository
+from repositories.migrator import Migrator
+from repositories.username_buffer import UsernameBuffer
+from repositories.user_cache import UserCache
+from repositories.fsm_storage import ExpiringMemoryStorage, PostgresStorage
+from metrics.metrics import REGISTRY, LoopLagMonitor
 from aiogram import Bot
+from aiogram.fsm.storage.base import BaseStorage
+
+async def create_fsm_storage(config: Config, repo: Repository, logger: Logger) -> BaseStorage:
+    if config.fsm_storage == "postgres":
+        return PostgresStorage(repo, logger, **config.fsm_ttl_config)
+    if config.fsm_storage == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+        except ImportError:
+            raise SystemExit("Для FSM_STORAGE=redis установите пакет redis")
+        # Redis сам удаляет ключи по TTL; раздельных сроков для разных состояний у RedisStorage нет.
+        ttl = int(config.fsm_ttl_config["default_ttl"])
+        return RedisStorage.from_url(
+            config.redis_url,
+            key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True),
+            state_ttl=ttl,
+            data_ttl=ttl
+        )
+    return ExpiringMemoryStorage(logger, **config.fsm_ttl_config)
+
+def register_gauges(fsm_storage: BaseStorage, expiry_scheduler: ExpiryScheduler, user_cache: UserCache,
+                    telegram_webhook: TelegramWebhook, outbox: Outbox):
+    REGISTRY.gauge("expiry_loop_lag_seconds", "Насколько просрочено ближайшее необработанное окончание подписки",
+                   callback=lambda: expiry_scheduler.lag)
+    if isinstance(fsm_storage, (ExpiringMemoryStorage, PostgresStorage)):
+        REGISTRY.gauge("fsm_states", "Активные состояния FSM (для postgres — оценка по статистике)", callback=lambda: fsm_storage.metrics["live"])
+    if isinstance(fsm_storage, ExpiringMemoryStorage):
+        REGISTRY.gauge("fsm_states_bytes", "Примерный объём состояний FSM в памяти",
+                       callback=lambda: fsm_storage.metrics["bytes"])
+    REGISTRY.gauge("outbox_pending", "Исходящие сообщения в очереди на отправку", callback=lambda: outbox.pending)
+    REGISTRY.gauge("user_cache_events", "Счётчики кеша пользователей", ("event",),
+                   callback=lambda: {**user_cache.stats, "size": len(user_cache.entries)})
+    if telegram_webhook is not None:
+        REGISTRY.gauge("telegram_webhook_queue_size", "Обновления в очереди вебхука",
+                       callback=telegram_webhook.queue.qsize)
+        REGISTRY.gauge("telegram_webhook_updates", "Счётчики вебхука Telegram", ("event",),
+                       callback=lambda: telegram_webhook.stats)
 
 async def main():
     config = Config()
     config.validate()
-    logger = Logger()
+    logger = Logger(**config.log_config)
     
     try:
-        repo = Repository(config.db_config, logger)
+        user_cache = UserCache(**config.user_cache_config)
+        repo = Repository(config.db_config, logger, **config.db_pool_config, user_cache=user_cache)
     except Exception as e:
-        logger.error(f"Не удалось подключиться к базе данных: {e}")
+        logger.error("Не удалось подключиться к базе данных: %s", e)
         raise SystemExit("Не удалось запустить бота")
 
-    crypto_service = CryptoService(config.crypto_bot_token, logger)
-    bot_service = BotService(repo, crypto_service, logger)
-    
+    migrator = Migrator(repo, logger)
+    try:
+        if config.migrate_on_start:
+            await migrator.migrate()
+        await migrator.check()
+    except Exception as e:
+        logger.error("Проверка схемы базы данных не пройдена: %s", e)
+        await repo.close()
+        raise SystemExit("Не удалось запустить бота")
+    try:
+        tariffs = TariffCatalog(config.tariffs_path, logger)
+    except Exception as e:
+        logger.error("Не удалось загрузить тарифы: %s", e)
+        raise SystemExit("Не удалось запустить бота")
     bot = Bot(token=config.bot_token)
+
+    crypto_service = CryptoService(config.crypto_bot_token, logger, **config.crypto_config)
+    expiry_scheduler = ExpiryScheduler(repo, logger, **config.expiry_config)
+    notifier = Notifier(bot, logger, **config.notifier_config)
+    outbox = Outbox(repo, notifier, logger, **config.outbox_config)
+    bot_service = BotService(repo, crypto_service, tariffs, logger, expiry_scheduler, outbox, **config.invoice_config)
+    # kill -HUP перечитывает тарифы без перезапуска.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, bot_service.reload_tariffs)
     
-    handler = Handler(bot, bot_service, logger)
+    username_buffer = UsernameBuffer(repo, logger, config.username_flush_interval)
+    fsm_storage = await create_fsm_storage(config, repo, logger)
+    handler = Handler(bot, bot_service, logger, username_buffer, fsm_storage, ThrottlingMiddleware(**config.throttle_config))
+    if isinstance(fsm_storage, (ExpiringMemoryStorage, PostgresStorage)):
+        asyncio.create_task(fsm_storage.run())
     
-    asyncio.create_task(bot_service.check_subscriptions(bot))
+    asyncio.create_task(outbox.run())
+    asyncio.create_task(bot_service.check_subscriptions())
+    asyncio.create_task(username_buffer.run())
+    reconciler = InvoiceReconciler(repo, crypto_service, bot_service, logger, **config.reconciler_config)
+    asyncio.create_task(reconciler.run())
+
+    app = web.Application()
+    if config.crypto_webhook_path:
+        CryptoPayWebhook(bot_service, config.crypto_bot_token, logger).register(app, config.crypto_webhook_path)
+    telegram_webhook = None
+    if config.bot_mode == "webhook":
+        telegram_webhook = TelegramWebhook(handler.dp, bot, logger, **config.telegram_webhook_config)
+        telegram_webhook.register(app, config.telegram_webhook_path)
+    if config.metrics_path:
+        register_gauges(fsm_storage, expiry_scheduler, user_cache, telegram_webhook, outbox)
+        MetricsEndpoint().register(app, config.metrics_path)
+        asyncio.create_task(LoopLagMonitor(config.loop_lag_interval).run())
+    runner = None
+    if app.router.routes():
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, config.http_host, config.http_port).start()
+        logger.info("HTTP-сервер запущен на %s:%s", config.http_host, config.http_port)
     
     logger.info("Запуск бота...")
-    await handler.start()
+    try:
+        if telegram_webhook is not None:
+            await handler.start_webhook(telegram_webhook, config.telegram_webhook_url.rstrip("/") + config.telegram_webhook_path)
+        else:
+            await handler.start()
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        await username_buffer.close()
+        await fsm_storage.close()
+        await outbox.close()
+        await crypto_service.close()
+        await repo.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,202 @@
+import asyncio
+import functools
+import time
+from collections import defaultdict, deque
+from typing import Callable, Optional, Union
+
+# Границы подобраны под задержки, которые встречаются у бота: от попаданий в кеш
+# (единицы миллисекунд) до таймаутов Crypto Pay и Telegram (секунды).
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = None) -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _check(self, labels: tuple) -> tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получено {labels}")
+        return tuple(str(label) for label in labels)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self.samples()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[self._check(labels)] += amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in self.values.items()]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 callback: Callable[[], Union[float, dict]] = None):
+        super().__init__(name, documentation, labelnames)
+        # callback читает значение в момент запроса метрик: так счётчики, которые
+        # компоненты и так ведут в своих stats, не приходится дублировать.
+        # Для метрики с одной меткой он может вернуть словарь {значение метки: число}.
+        self.callback = callback
+        self.values: dict[tuple, float] = {}
+
+    def set(self, value: float, *labels):
+        self.values[self._check(labels)] = value
+
+    def samples(self) -> list[str]:
+        values = self.values
+        if self.callback is not None:
+            result = self.callback()
+            if isinstance(result, dict):
+                values = {(str(label),): value for label, value in result.items()}
+            else:
+                values = {(): result}
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in values.items() if value is not None]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счётчики по корзинам (без накопления), сумма и количество.
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        labels = self._check(labels)
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            inf = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        self.metrics.pop(name, None)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = (), callback: Callable = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def timed(histogram: Histogram, errors: Optional[Counter] = None):
+    # Метка — имя функции: декоратор вешается на методы Repository и подобных классов,
+    # где имя метода и есть название операции.
+    def decorator(func):
+        operation = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(operation)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, operation)
+        return wrapper
+    return decorator
+
+
+LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds", "Насколько позже срока просыпается таймер event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.5, max_samples: int = 0):
+        self.interval = interval
+        # Сырые замеры нужны только нагрузочным прогонам; в боте хватает гистограммы.
+        self.samples = deque(maxlen=max_samples)
+
+    async def run(self):
+        # Задержка event loop — насколько позже срока просыпается sleep(interval):
+        # столько же ждёт любой готовый к работе обработчик.
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(lag)
+            LOOP_LAG.observe(lag)
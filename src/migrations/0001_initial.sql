@@ -0,0 +1,18 @@
+-- Базовая схема. IF NOT EXISTS: на уже работающих базах таблицы созданы вручную.
+CREATE TABLE IF NOT EXISTS users (
+    user_id BIGINT PRIMARY KEY,
+    subscription_end TIMESTAMP,
+    exchange TEXT,
+    api_key TEXT,
+    username TEXT,
+    is_referral BOOLEAN NOT NULL DEFAULT FALSE,
+    subscription_type TEXT
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+    invoice_id BIGINT PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    amount NUMERIC NOT NULL,
+    currency TEXT NOT NULL,
+    status TEXT NOT NULL
+);
@@ -0,0 +1,9 @@
+-- Повторное использование открытых инвойсов и ключ идемпотентности.
+ALTER TABLE payments
+    ADD COLUMN IF NOT EXISTS tariff_id TEXT,
+    ADD COLUMN IF NOT EXISTS pay_url TEXT,
+    ADD COLUMN IF NOT EXISTS created_at TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS payments_open_idempotency_key
+    ON payments (idempotency_key) WHERE status = 'created';
@@ -0,0 +1,7 @@
+-- Хранилище FSM (FSM_STORAGE=postgres).
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
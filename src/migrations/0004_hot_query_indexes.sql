@@ -0,0 +1,17 @@
+-- Ближайшее окончание подписки и пакетное истечение: MIN(subscription_end), subscription_end < now().
+CREATE INDEX IF NOT EXISTS users_subscription_end ON users (subscription_end);
+
+-- Платежи пользователя и последний платёж: user_id = ? ORDER BY invoice_id DESC LIMIT 1.
+CREATE INDEX IF NOT EXISTS payments_user_id_invoice_id ON payments (user_id, invoice_id DESC);
+
+-- Сверка неоплаченных инвойсов страницами: status = 'created' AND invoice_id > ? ORDER BY invoice_id.
+-- Оплаченных и просроченных платежей на порядки больше, поэтому индекс частичный.
+CREATE INDEX IF NOT EXISTS payments_created_invoice_id ON payments (invoice_id) WHERE status = 'created';
+
+-- Сборщик устаревших состояний FSM.
+CREATE INDEX IF NOT EXISTS fsm_states_updated_at ON fsm_states (updated_at);
+
+-- Статистика для планировщика сразу после создания индексов.
+ANALYZE users;
+ANALYZE payments;
+ANALYZE fsm_states;
@@ -0,0 +1,16 @@
+-- Исходящие сообщения, которые должны пережить перезапуск: подтверждения оплаты и
+-- уведомления об истечении подписки. Строка удаляется после доставки.
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    text TEXT NOT NULL,
+    options JSONB NOT NULL DEFAULT '{}'::jsonb,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Выборка очередной порции: status = 'pending' AND next_attempt_at <= now().
+-- Недоставленные (status = 'failed') остаются для разбора и в индекс не попадают.
+CREATE INDEX IF NOT EXISTS outbox_pending_next_attempt ON outbox (next_attempt_at) WHERE status = 'pending';
@@ -0,0 +1,12 @@
+from typing import Optional
+
+class OutboxMessage:
+    def __init__(self, chat_id: int, text: str, options: Optional[dict] = None, critical: bool = False,
+                 outbox_id: Optional[int] = None, attempts: int = 0, created_at: Optional[float] = None):
+        self.chat_id = chat_id
+        self.text = text
+        self.options = options or {}
+        self.critical = critical
+        self.outbox_id = outbox_id
+        self.attempts = attempts
+        self.created_at = created_at
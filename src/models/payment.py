@@ -1,7 +1,16 @@
+from datetime import datetime
+from typing import Optional
+
 class Payment:
-    def __init__(self, invoice_id : int, user_id : int, amount : float, currency : str, status : str):
+    def __init__(self, invoice_id : int, user_id : int, amount : float, currency : str, status : str,
+                 tariff_id : Optional[str] = None, pay_url : Optional[str] = None, created_at : Optional[datetime] = None,
+                 idempotency_key : Optional[str] = None):
         self.invoice_id = invoice_id
         self.user_id = user_id
         self.amount = amount
         self.currency = currency
-        self.status = status
\ No newline at end of file
+        self.status = status
+        self.tariff_id = tariff_id
+        self.pay_url = pay_url
+        self.created_at = created_at
+        self.idempotency_key = idempotency_key
\ No newline at end of file
@@ -0,0 +1,13 @@
+from typing import Optional
+from aiogram import types
+
+class Response:
+    # Итог обработки нажатия или сообщения: один экран (текст и клавиатура) и/или короткое
+    # уведомление поверх чата. Как доставить его за наименьшее число вызовов Bot API,
+    # решает ResponseRenderer.
+    def __init__(self, text: Optional[str] = None, reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+                 notice: Optional[str] = None, success: bool = True):
+        self.text = text
+        self.reply_markup = reply_markup
+        self.notice = notice
+        self.success = success
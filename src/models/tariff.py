@@ -0,0 +1,8 @@
+class Tariff:
+    def __init__(self, tariff_id : str, subscription_type : str, days : int, price : float, name : str):
+        self.tariff_id = tariff_id
+        self.subscription_type = subscription_type
+        self.days = days
+        self.price = price
+        self.name = name
+        self.price_cents = round(price * 100)
@@ -1,161 +1,729 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Callable
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import RealDictCursor, Json, execute_values
+import psycopg2
 from models.user import User
 from models.payment import Payment
+from models.outbox_message import OutboxMessage
+from repositories.user_cache import UserCache
+from metrics.metrics import REGISTRY, timed
 from logger.logger import Logger
 
+QUERY_SECONDS = REGISTRY.histogram("db_query_duration_seconds", "Время операций Repository", ("operation",))
+QUERY_ERRORS = REGISTRY.counter("db_query_errors_total", "Ошибки операций Repository", ("operation",))
+POOL_WAIT_SECONDS = REGISTRY.histogram("db_pool_wait_seconds", "Ожидание свободного соединения с базой")
+
+# Запросы Repository — константы модуля: tools/check_query_plans проверяет планы именно
+# этих строк, а запрос, написанный прямо в методе, он считает ошибкой.
+INSERT_OUTBOX_SQL = "INSERT INTO outbox (chat_id, text, options) VALUES %s"
+
+GET_USER_SQL = "SELECT * FROM users WHERE user_id = %s"
+
+TOUCH_USER_SQL = """
+INSERT INTO users (user_id, username, is_referral)
+VALUES (%s, %s, FALSE)
+ON CONFLICT (user_id)
+DO UPDATE SET username = EXCLUDED.username
+RETURNING *
+"""
+
+SAVE_USER_SQL = """
+INSERT INTO users (user_id, subscription_end, exchange, api_key, username, is_referral, subscription_type)
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (user_id)
+DO UPDATE SET subscription_end = EXCLUDED.subscription_end,
+              exchange = EXCLUDED.exchange,
+              api_key = EXCLUDED.api_key,
+              username = EXCLUDED.username,
+              is_referral = EXCLUDED.is_referral,
+              subscription_type = EXCLUDED.subscription_type
+"""
+
+SET_SUBSCRIPTION_TYPE_SQL = """
+INSERT INTO users (user_id, username, is_referral, subscription_type)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT (user_id)
+DO UPDATE SET is_referral = EXCLUDED.is_referral, subscription_type = EXCLUDED.subscription_type
+RETURNING *
+"""
+
+SET_EXCHANGE_SQL = """
+INSERT INTO users (user_id, username, is_referral, exchange, api_key)
+VALUES (%s, %s, FALSE, %s, %s)
+ON CONFLICT (user_id)
+DO UPDATE SET exchange = EXCLUDED.exchange, api_key = EXCLUDED.api_key
+RETURNING *
+"""
+
+UPDATE_USERNAMES_SQL = """
+UPDATE users AS u SET username = v.username
+FROM (VALUES %s) AS v(user_id, username)
+WHERE u.user_id = v.user_id AND u.username IS DISTINCT FROM v.username
+"""
+
+DELETE_USER_SQL = "DELETE FROM users WHERE user_id = %s"
+
+GET_EXPIRED_USERS_SQL = "SELECT * FROM users WHERE subscription_end < %s"
+
+EXPIRE_USERS_SQL = """
+DELETE FROM users
+WHERE user_id IN (
+    SELECT user_id FROM users
+    WHERE subscription_end < %s
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING *
+"""
+
+GET_NEXT_SUBSCRIPTION_END_SQL = "SELECT MIN(subscription_end) AS next_end FROM users"
+
+SAVE_PAYMENT_SQL = """
+INSERT INTO payments (invoice_id, user_id, amount, currency, status, tariff_id, pay_url, created_at, idempotency_key)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (idempotency_key) WHERE status = 'created' DO NOTHING
+RETURNING *
+"""
+
+GET_OPEN_PAYMENT_SQL = "SELECT * FROM payments WHERE idempotency_key = %s AND status = 'created'"
+
+RELEASE_IDEMPOTENCY_KEY_SQL = "UPDATE payments SET idempotency_key = NULL WHERE invoice_id = %s"
+
+UPDATE_PAYMENT_STATUS_SQL = "UPDATE payments SET status = %s WHERE invoice_id = %s"
+
+UPDATE_PAYMENT_STATUSES_SQL = "UPDATE payments SET status = %s WHERE invoice_id = ANY(%s) AND status = %s"
+
+GET_PENDING_PAYMENTS_SQL = "SELECT * FROM payments WHERE status = 'created' AND invoice_id > %s ORDER BY invoice_id LIMIT %s"
+
+MARK_PAYMENT_PAID_SQL = "UPDATE payments SET status = 'paid' WHERE invoice_id = %s AND status <> 'paid' RETURNING invoice_id"
+
+EXTEND_SUBSCRIPTION_SQL = """
+INSERT INTO users (user_id, subscription_end, is_referral, subscription_type)
+VALUES (%s, %s + %s * interval '1 day', FALSE, %s)
+ON CONFLICT (user_id)
+DO UPDATE SET subscription_end = GREATEST(users.subscription_end, %s) + %s * interval '1 day',
+              subscription_type = EXCLUDED.subscription_type
+RETURNING *
+"""
+
+GET_PAYMENTS_BY_USER_SQL = "SELECT * FROM payments WHERE user_id = %s"
+
+GET_LAST_PAYMENT_SQL = "SELECT * FROM payments WHERE user_id = %s ORDER BY invoice_id DESC LIMIT 1"
+
+GET_FSM_RECORDS_SQL = "SELECT key, state, data FROM fsm_states WHERE key = ANY(%s)"
+
+DELETE_FSM_RECORDS_SQL = "DELETE FROM fsm_states WHERE key = ANY(%s)"
+
+UPSERT_FSM_RECORDS_SQL = """
+INSERT INTO fsm_states (key, state, data) VALUES %s
+ON CONFLICT (key)
+DO UPDATE SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = now()
+"""
+
+DELETE_EMPTY_FSM_STATE_SQL = "DELETE FROM fsm_states WHERE key = %s AND data = '{}'::jsonb"
+
+CLEAR_FSM_STATE_SQL = "UPDATE fsm_states SET state = NULL, updated_at = now() WHERE key = %s"
+
+SET_FSM_STATE_SQL = """
+INSERT INTO fsm_states (key, state) VALUES (%s, %s)
+ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, updated_at = now()
+"""
+
+DELETE_EMPTY_FSM_DATA_SQL = "DELETE FROM fsm_states WHERE key = %s AND state IS NULL"
+
+CLEAR_FSM_DATA_SQL = "UPDATE fsm_states SET data = '{}'::jsonb, updated_at = now() WHERE key = %s"
+
+SET_FSM_DATA_SQL = """
+INSERT INTO fsm_states (key, data) VALUES (%s, %s)
+ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data, updated_at = now()
+"""
+
+MERGE_FSM_DATA_SQL = """
+INSERT INTO fsm_states (key, data) VALUES (%s, %s)
+ON CONFLICT (key) DO UPDATE SET data = fsm_states.data || EXCLUDED.data, updated_at = now()
+RETURNING data
+"""
+
+DELETE_STALE_FSM_STATES_SQL = """
+DELETE FROM fsm_states
+WHERE updated_at < now() - make_interval(secs => %s)
+  AND updated_at < now() - make_interval(secs => COALESCE((%s::jsonb ->> state)::float, %s))
+"""
+
+COUNT_FSM_STATES_SQL = """
+SELECT GREATEST(c.reltuples, 0) * (1 - COALESCE(s.null_frac, 0)) AS live
+FROM pg_class c
+LEFT JOIN pg_stats s
+  ON s.schemaname = current_schema() AND s.tablename = 'fsm_states' AND s.attname = 'state'
+WHERE c.oid = 'fsm_states'::regclass
+"""
+
+CLAIM_OUTBOX_SQL = """
+UPDATE outbox
+SET attempts = attempts + 1, next_attempt_at = now() + make_interval(secs => %s)
+WHERE id IN (
+    SELECT id FROM outbox
+    WHERE status = 'pending' AND next_attempt_at <= now()
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING *, extract(epoch FROM created_at)::float AS created_ts
+"""
+
+RENEW_OUTBOX_SQL = """
+UPDATE outbox SET next_attempt_at = now() + make_interval(secs => %s)
+WHERE id = ANY(%s) AND status = 'pending'
+"""
+
+COMPLETE_OUTBOX_SQL = "DELETE FROM outbox WHERE id = ANY(%s)"
+
+RETRY_OUTBOX_SQL = "UPDATE outbox SET next_attempt_at = now() + make_interval(secs => %s) WHERE id = %s"
+
+FAIL_OUTBOX_SQL = "UPDATE outbox SET status = 'failed' WHERE id = %s"
+
 class Repository:
-    def __init__(self, db_config: dict, logger: Logger):
+    def __init__(self, db_config: dict, logger: Logger, min_size: int = 1, max_size: int = 10,
+                 acquire_timeout: float = 5.0, connect_timeout: int = 5, statement_timeout: int = 5000,
+                 user_cache: UserCache = None):
         self.logger = logger
+        self.user_cache = user_cache
+        self.acquire_timeout = acquire_timeout
         try:
-            self.conn = psycopg2.connect(**db_config, cursor_factory=RealDictCursor)
+            self.pool = ThreadedConnectionPool(
+                min_size,
+                max_size,
+                **db_config,
+                cursor_factory=RealDictCursor,
+                connect_timeout=connect_timeout,
+                client_encoding="UTF8",
+                options=f"-c statement_timeout={statement_timeout}"
+            )
         except Exception as e:
-            self.logger.error(f"Ошибка подключения к базе данных {e}")
+            self.logger.error("Ошибка подключения к базе данных %s", e)
             raise
-        self.logger.info("Подключение к базе данных успешно установлено")
-        self.cursor = self.conn.cursor()
+        self.logger.info("Пул подключений к базе данных создан (min=%s, max=%s)", min_size, max_size)
+        # Потоков ровно столько, сколько соединений в пуле: getconn никогда не упирается в лимит,
+        # а семафор ограничивает время ожидания свободного соединения.
+        self.executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix="db")
+        self.slots = asyncio.Semaphore(max_size)
+
+    async def _run(self, work):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Нет свободного соединения с базой данных за {self.acquire_timeout} с")
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self._run_in_connection, work)
+        finally:
+            self.slots.release()
 
-    def get_user(self, user_id: int) -> User:
-        self.logger.info(f"Получение пользователя с ID {user_id}")
+    def _run_in_connection(self, work):
+        conn = self.pool.getconn()
+        broken = False
         try:
-            self.cursor.execute("SELECT * FROM users WHERE user_id = %s", (user_id,))
-            result = self.cursor.fetchone()
+            with conn.cursor() as cursor:
+                result = work(cursor)
+            conn.commit()
+            return result
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    async def _fetchone(self, query: str, params: tuple = ()):
+        def work(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchone()
+        return await self._run(work)
+
+    async def _fetchall(self, query: str, params: tuple = ()):
+        def work(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        return await self._run(work)
+
+    async def _execute(self, query: str, params: tuple = ()):
+        def work(cursor):
+            cursor.execute(query, params)
+            return cursor.rowcount
+        return await self._run(work)
+
+    @staticmethod
+    def _row_to_user(result) -> User:
+        return User(
+            user_id=result['user_id'],
+            subscription_end=result.get('subscription_end'),
+            exchange=result.get('exchange'),
+            api_key=result.get('api_key'),
+            username=result.get('username'),
+            is_referral=result.get('is_referral', False),
+            subscription_type=result.get('subscription_type')
+        )
+
+    @staticmethod
+    def _row_to_payment(result) -> Payment:
+        return Payment(
+            invoice_id=result['invoice_id'],
+            user_id=result['user_id'],
+            amount=result['amount'],
+            currency=result['currency'],
+            status=result['status'],
+            tariff_id=result.get('tariff_id'),
+            pay_url=result.get('pay_url'),
+            created_at=result.get('created_at'),
+            idempotency_key=result.get('idempotency_key')
+        )
+
+    @staticmethod
+    def _row_to_outbox_message(result) -> OutboxMessage:
+        return OutboxMessage(
+            chat_id=result['chat_id'],
+            text=result['text'],
+            options=result['options'],
+            critical=True,
+            outbox_id=result['id'],
+            attempts=result['attempts'],
+            created_at=result['created_ts']
+        )
+
+    @staticmethod
+    def _insert_outbox(cursor, messages: list[OutboxMessage]):
+        # Исходящие сообщения пишутся в той же транзакции, что и изменение, о котором они
+        # сообщают: либо есть и то и другое, либо ничего. Доставит их опрос Outbox.
+        execute_values(
+            cursor,
+            INSERT_OUTBOX_SQL,
+            [(message.chat_id, message.text, Json(message.options)) for message in messages],
+            page_size=len(messages)
+        )
+
+    def cache_user(self, user: User):
+        if self.user_cache is not None:
+            self.user_cache.put(user)
+
+    def cache_username(self, user_id: int, username: str):
+        # Правка на месте: срок жизни записи не продлевается, иначе смена username
+        # продлевала бы и устаревшие subscription_end/exchange.
+        if self.user_cache is not None:
+            self.user_cache.update_username(user_id, username)
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def get_user(self, user_id: int) -> User:
+        self.logger.debug("Получение пользователя с ID %s", user_id)
+        if self.user_cache is not None:
+            user = self.user_cache.get(user_id)
+            if user is not None:
+                return user
+        try:
+            result = await self._fetchone(GET_USER_SQL, (user_id,))
             if result:
-                return User(
-                    user_id=result['user_id'],
-                    subscription_end=result.get('subscription_end'),
-                    exchange=result.get('exchange'),
-                    api_key=result.get('api_key'),
-                    username=result.get('username'),
-                    is_referral=result.get('is_referral', False),
-                    subscription_type=result.get('subscription_type')
-                )
+                user = self._row_to_user(result)
+                self.cache_user(user)
+                return user
             return None
         except Exception as e:
-            self.logger.error(f"Ошибка при получении пользователя: {e}")
+            self.logger.error("Ошибка при получении пользователя: %s", e)
             raise
 
-    def save_user(self, user: User):
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def touch_user(self, user_id: int, username: str) -> User:
         try:
-            self.logger.info(f"Сохранение пользователя: user_id={user.user_id}, subscription_end={user.subscription_end}, exchange={user.exchange}, api_key={user.api_key}, username={user.username}, is_referral={user.is_referral}, subscription_type={user.subscription_type}")
-            self.cursor.execute(
-                """
-                INSERT INTO users (user_id, subscription_end, exchange, api_key, username, is_referral, subscription_type)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (user_id)
-                DO UPDATE SET subscription_end = EXCLUDED.subscription_end,
-                              exchange = EXCLUDED.exchange,
-                              api_key = EXCLUDED.api_key,
-                              username = EXCLUDED.username,
-                              is_referral = EXCLUDED.is_referral,
-                              subscription_type = EXCLUDED.subscription_type
-                """,
+            result = await self._fetchone(TOUCH_USER_SQL, (user_id, username))
+            user = self._row_to_user(result)
+            self.cache_user(user)
+            return user
+        except Exception as e:
+            self.logger.error("Ошибка при обновлении пользователя %s: %s", user_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def save_user(self, user: User):
+        try:
+            self.logger.debug("Сохранение пользователя: user_id=%s, subscription_end=%s, exchange=%s, is_referral=%s, subscription_type=%s",
+                              user.user_id, user.subscription_end, user.exchange, user.is_referral, user.subscription_type)
+            await self._execute(
+                SAVE_USER_SQL,
                 (user.user_id, user.subscription_end, user.exchange, user.api_key, user.username, user.is_referral, user.subscription_type)
             )
-            self.conn.commit()
-            self.logger.info(f"Пользователь {user.user_id} успешно сохранён в базе данных")
+            self.cache_user(user)
+            self.logger.debug("Пользователь %s успешно сохранён в базе данных", user.user_id)
         except Exception as e:
-            self.conn.rollback()
-            self.logger.error(f"Ошибка при сохранении пользователя {user.user_id}: {str(e)}")
+            self.logger.error("Ошибка при сохранении пользователя %s: %s", user.user_id, e)
             raise
 
-    def delete_user(self, user_id: int):
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def set_subscription_type(self, user: User, subscription_type: str, is_referral: bool) -> User:
+        # Объект user может быть из кеша и отставать от базы (оплату применила другая реплика),
+        # поэтому пишутся только изменённые столбцы, а в ответ берётся актуальная строка.
         try:
-            self.logger.info(f"Удаление пользователя с ID {user_id}")
-            self.cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
-            self.conn.commit()
+            result = await self._fetchone(
+                SET_SUBSCRIPTION_TYPE_SQL,
+                (user.user_id, user.username, is_referral, subscription_type)
+            )
+            user = self._row_to_user(result)
+            self.cache_user(user)
+            return user
         except Exception as e:
-            self.logger.error(f"Ошибка при удалении пользователя {user_id}: {e}")
+            self.logger.error("Ошибка при сохранении типа подписки пользователя %s: %s", user.user_id, e)
             raise
 
-    def get_expired_users(self) -> list[User]:
-        self.logger.info("Получение списка просроченных пользователей")
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def set_exchange(self, user: User, exchange: str, api_key: str) -> User:
         try:
-            self.cursor.execute(
-                "SELECT * FROM users WHERE subscription_end < %s",
-                (datetime.now(),)
-            )
-            results = self.cursor.fetchall()
-            return [User(
-                user_id=result['user_id'],
-                subscription_end=result.get('subscription_end'),
-                exchange=result.get('exchange'),
-                api_key=result.get('api_key'),
-                username=result.get('username'),
-                is_referral=result.get('is_referral', False),
-                subscription_type=result.get('subscription_type')
-            ) for result in results]
-        except Exception as e:
-            self.logger.error(f"Ошибка при получении просроченных пользователей: {e}")
-            raise
-
-    def save_payment(self, payment: Payment):
-        try:
-            self.logger.info(f"Сохранение платежа для пользователя {payment.user_id} на сумму {payment.amount} {payment.currency}")
-            self.cursor.execute(
-                """
-                INSERT INTO payments (invoice_id, user_id, amount, currency, status)
-                VALUES (%s, %s, %s, %s, %s)
-                """,
-                (payment.invoice_id, payment.user_id, payment.amount, payment.currency, payment.status)
+            result = await self._fetchone(SET_EXCHANGE_SQL, (user.user_id, user.username, exchange, api_key))
+            user = self._row_to_user(result)
+            self.cache_user(user)
+            return user
+        except Exception as e:
+            self.logger.error("Ошибка при сохранении биржи пользователя %s: %s", user.user_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def update_usernames(self, usernames: dict[int, str]) -> int:
+        if not usernames:
+            return 0
+        def work(cursor):
+            execute_values(
+                cursor,
+                UPDATE_USERNAMES_SQL,
+                list(usernames.items()),
+                template="(%s::bigint, %s::text)",
+                page_size=len(usernames)
             )
-            self.conn.commit()
-            self.logger.info(f"Платеж для пользователя {payment.user_id} успешно сохранен")
+            return cursor.rowcount
+        try:
+            updated = await self._run(work)
+            if self.user_cache is not None:
+                for user_id, username in usernames.items():
+                    self.user_cache.update_username(user_id, username)
+            self.logger.info("Обновлено username пользователей: %s из %s", updated, len(usernames))
+            return updated
         except Exception as e:
-            self.logger.error(f"Ошибка при сохранении платежа для пользователя {payment.user_id}: {e}")
+            self.logger.error("Ошибка пакетного обновления username: %s", e)
             raise
 
-    def update_payment_status(self, invoice_id: int, status: str):
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def delete_user(self, user_id: int):
         try:
-            self.logger.info(f"Обновление статуса платежа для инвойса {invoice_id} на {status}")
-            self.cursor.execute(
-                "UPDATE payments SET status = %s WHERE invoice_id = %s",
-                (status, invoice_id)
-            )
-            self.conn.commit()
-            self.logger.info(f"Статус платежа для инвойса {invoice_id} успешно обновлен")
+            self.logger.info("Удаление пользователя с ID %s", user_id)
+            await self._execute(DELETE_USER_SQL, (user_id,))
+            if self.user_cache is not None:
+                self.user_cache.invalidate(user_id)
+        except Exception as e:
+            self.logger.error("Ошибка при удалении пользователя %s: %s", user_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def get_expired_users(self) -> list[User]:
+        self.logger.info("Получение списка просроченных пользователей")
+        try:
+            results = await self._fetchall(GET_EXPIRED_USERS_SQL, (datetime.now(),))
+            return [self._row_to_user(result) for result in results]
+        except Exception as e:
+            self.logger.error("Ошибка при получении просроченных пользователей: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def expire_users(self, limit: int = 1000, notice: OutboxMessage = None) -> list[User]:
+        def work(cursor):
+            cursor.execute(EXPIRE_USERS_SQL, (datetime.now(), limit))
+            results = cursor.fetchall()
+            if notice is not None and results:
+                self._insert_outbox(cursor, [
+                    OutboxMessage(result['user_id'], notice.text, notice.options) for result in results
+                ])
+            return results
+        try:
+            results = await self._run(work)
+            self.logger.info("Удалено просроченных пользователей: %s", len(results))
+            if self.user_cache is not None:
+                for result in results:
+                    self.user_cache.invalidate(result['user_id'])
+            return [self._row_to_user(result) for result in results]
         except Exception as e:
-            self.logger.error(f"Ошибка при обновлении статуса платежа для инвойса {invoice_id}: {e}")
+            self.logger.error("Ошибка при удалении просроченных пользователей: %s", e)
             raise
 
-    def get_payments_by_user(self, user_id: int) -> list[Payment]:
-        self.logger.info(f"Получение платежей для пользователя с ID {user_id}")
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def get_next_subscription_end(self) -> datetime:
         try:
-            self.cursor.execute("SELECT * FROM payments WHERE user_id = %s", (user_id,))
-            results = self.cursor.fetchall()
-            return [Payment(
-                invoice_id=result['invoice_id'],
-                user_id=result['user_id'],
-                amount=result['amount'],
-                currency=result['currency'],
-                status=result['status']
-            ) for result in results]
+            result = await self._fetchone(GET_NEXT_SUBSCRIPTION_END_SQL)
+            return result['next_end'] if result else None
         except Exception as e:
-            self.logger.error(f"Ошибка при получении платежей для пользователя {user_id}: {e}")
+            self.logger.error("Ошибка при получении ближайшего окончания подписки: %s", e)
             raise
 
-    def get_last_payment(self, user_id: int) -> Payment:
-        self.logger.info(f"Получение последнего платежа для пользователя с ID {user_id}")
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def save_payment(self, payment: Payment) -> Payment:
         try:
-            self.cursor.execute(
-                "SELECT * FROM payments WHERE user_id = %s ORDER BY invoice_id DESC LIMIT 1",
-                (user_id,)
+            self.logger.debug("Сохранение платежа для пользователя %s на сумму %s %s", payment.user_id, payment.amount, payment.currency)
+            # Ключ идемпотентности уникален среди неоплаченных платежей: если другая реплика
+            # успела сохранить инвойс с тем же ключом, вставка пропускается и возвращается None.
+            result = await self._fetchone(
+                SAVE_PAYMENT_SQL,
+                (payment.invoice_id, payment.user_id, payment.amount, payment.currency, payment.status,
+                 payment.tariff_id, payment.pay_url, payment.created_at or datetime.now(), payment.idempotency_key)
             )
-            result = self.cursor.fetchone()
+            if result is None:
+                self.logger.info("Платеж с ключом %s уже сохранён", payment.idempotency_key)
+                return None
+            self.logger.info("Платеж для пользователя %s успешно сохранен", payment.user_id)
+            return self._row_to_payment(result)
+        except Exception as e:
+            self.logger.error("Ошибка при сохранении платежа для пользователя %s: %s", payment.user_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def get_open_payment(self, idempotency_key: str) -> Payment:
+        try:
+            result = await self._fetchone(GET_OPEN_PAYMENT_SQL, (idempotency_key,))
+            return self._row_to_payment(result) if result else None
+        except Exception as e:
+            self.logger.error("Ошибка при получении открытого платежа %s: %s", idempotency_key, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def release_idempotency_key(self, invoice_id: int):
+        # Инвойс остаётся в статусе created (его ещё могут оплатить, сверка его найдёт),
+        # но перестаёт занимать ключ, и под ним можно сохранить новый.
+        try:
+            await self._execute(RELEASE_IDEMPOTENCY_KEY_SQL, (invoice_id,))
+        except Exception as e:
+            self.logger.error("Ошибка при освобождении ключа платежа %s: %s", invoice_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def update_payment_status(self, invoice_id: int, status: str):
+        try:
+            self.logger.info("Обновление статуса платежа для инвойса %s на %s", invoice_id, status)
+            await self._execute(UPDATE_PAYMENT_STATUS_SQL, (status, invoice_id))
+            self.logger.info("Статус платежа для инвойса %s успешно обновлен", invoice_id)
+        except Exception as e:
+            self.logger.error("Ошибка при обновлении статуса платежа для инвойса %s: %s", invoice_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def update_payment_statuses(self, invoice_ids: list[int], status: str, from_status: str = "created") -> int:
+        try:
+            self.logger.info("Обновление статуса %s платежей на %s", len(invoice_ids), status)
+            return await self._execute(UPDATE_PAYMENT_STATUSES_SQL, (status, list(invoice_ids), from_status))
+        except Exception as e:
+            self.logger.error("Ошибка при пакетном обновлении статуса платежей: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def get_pending_payments(self, after_invoice_id: int = 0, limit: int = 100) -> list[Payment]:
+        try:
+            results = await self._fetchall(GET_PENDING_PAYMENTS_SQL, (after_invoice_id, limit))
+            return [self._row_to_payment(result) for result in results]
+        except Exception as e:
+            self.logger.error("Ошибка при получении неоплаченных платежей: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def apply_payment(self, invoice_id: int, user_id: int, days: int, subscription_type: str,
+                            notice: Callable[[User], OutboxMessage] = None) -> User:
+        def work(cursor):
+            # Статус платежа меняется в той же транзакции, что и подписка: повторное
+            # подтверждение (вебхук, кнопка, сверка) не продлит подписку дважды.
+            cursor.execute(MARK_PAYMENT_PAID_SQL, (invoice_id,))
+            if cursor.fetchone() is None:
+                return None
+            now = datetime.now()
+            cursor.execute(EXTEND_SUBSCRIPTION_SQL, (user_id, now, days, subscription_type, now, days))
+            result = cursor.fetchone()
+            if notice is not None:
+                # Подтверждение строится по уже продлённой подписке и фиксируется вместе с ней.
+                self._insert_outbox(cursor, [notice(self._row_to_user(result))])
+            return result
+        try:
+            self.logger.info("Применение платежа %s для пользователя %s: %s дн.", invoice_id, user_id, days)
+            result = await self._run(work)
+            if result is None:
+                self.logger.info("Платеж %s уже применён или не найден", invoice_id)
+                return None
+            user = self._row_to_user(result)
+            self.cache_user(user)
+            return user
+        except Exception as e:
+            self.logger.error("Ошибка при применении платежа %s: %s", invoice_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def get_payments_by_user(self, user_id: int) -> list[Payment]:
+        self.logger.debug("Получение платежей для пользователя с ID %s", user_id)
+        try:
+            results = await self._fetchall(GET_PAYMENTS_BY_USER_SQL, (user_id,))
+            return [self._row_to_payment(result) for result in results]
+        except Exception as e:
+            self.logger.error("Ошибка при получении платежей для пользователя %s: %s", user_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def get_last_payment(self, user_id: int) -> Payment:
+        self.logger.debug("Получение последнего платежа для пользователя с ID %s", user_id)
+        try:
+            result = await self._fetchone(GET_LAST_PAYMENT_SQL, (user_id,))
             if result:
-                return Payment(
-                    invoice_id=result['invoice_id'],
-                    user_id=result['user_id'],
-                    amount=result['amount'],
-                    currency=result['currency'],
-                    status=result['status']
-                )
+                return self._row_to_payment(result)
             return None
         except Exception as e:
-            self.logger.error(f"Ошибка при получении последнего платежа для пользователя {user_id}: {e}")
+            self.logger.error("Ошибка при получении последнего платежа для пользователя %s: %s", user_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def get_fsm_records(self, keys: list[str]) -> dict[str, tuple]:
+        try:
+            results = await self._fetchall(GET_FSM_RECORDS_SQL, (list(keys),))
+            return {result['key']: (result['state'], result['data']) for result in results}
+        except Exception as e:
+            self.logger.error("Ошибка при получении состояний FSM: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def set_fsm_records(self, records: dict[str, tuple]):
+        if not records:
+            return
+        def work(cursor):
+            # Пустые записи (без состояния и данных) удаляются, чтобы таблица не росла
+            # за счёт пользователей, которые просто открыли меню.
+            empty = [key for key, (state, data) in records.items() if state is None and not data]
+            filled = [(key, state, Json(data or {})) for key, (state, data) in records.items() if key not in empty]
+            if empty:
+                cursor.execute(DELETE_FSM_RECORDS_SQL, (empty,))
+            if filled:
+                execute_values(
+                    cursor,
+                    UPSERT_FSM_RECORDS_SQL,
+                    filled,
+                    page_size=len(filled)
+                )
+        try:
+            await self._run(work)
+        except Exception as e:
+            self.logger.error("Ошибка при пакетном сохранении состояний FSM: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def set_fsm_state(self, key: str, state: str):
+        def work(cursor):
+            if state is None:
+                cursor.execute(DELETE_EMPTY_FSM_STATE_SQL, (key,))
+                cursor.execute(CLEAR_FSM_STATE_SQL, (key,))
+            else:
+                cursor.execute(SET_FSM_STATE_SQL, (key, state))
+        try:
+            await self._run(work)
+        except Exception as e:
+            self.logger.error("Ошибка при сохранении состояния FSM %s: %s", key, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def set_fsm_data(self, key: str, data: dict):
+        def work(cursor):
+            if not data:
+                cursor.execute(DELETE_EMPTY_FSM_DATA_SQL, (key,))
+                cursor.execute(CLEAR_FSM_DATA_SQL, (key,))
+            else:
+                cursor.execute(SET_FSM_DATA_SQL, (key, Json(data)))
+        try:
+            await self._run(work)
+        except Exception as e:
+            self.logger.error("Ошибка при сохранении данных FSM %s: %s", key, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def merge_fsm_data(self, key: str, data: dict) -> dict:
+        try:
+            result = await self._fetchone(MERGE_FSM_DATA_SQL, (key, Json(data)))
+            return result['data']
+        except Exception as e:
+            self.logger.error("Ошибка при обновлении данных FSM %s: %s", key, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def delete_stale_fsm_states(self, state_ttls: dict[str, float], default_ttl: float) -> int:
+        try:
+            return await self._execute(
+                DELETE_STALE_FSM_STATES_SQL,
+                # Первое условие — по самому короткому сроку: оно отсекает свежие записи по индексу updated_at.
+                (min([default_ttl, *state_ttls.values()]), Json(state_ttls), default_ttl)
+            )
+        except Exception as e:
+            self.logger.error("Ошибка при удалении устаревших состояний FSM: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def count_fsm_states(self) -> int:
+        # Оценка по статистике планировщика (строки таблицы × доля непустых state), а не
+        # count(*): точный подсчёт — полный проход по fsm_states на каждой очистке ради одного
+        # gauge. Оценку обновляют autovacuum/ANALYZE; до первого ANALYZE она равна нулю.
+        try:
+            result = await self._fetchone(COUNT_FSM_STATES_SQL)
+            return int(result['live'])
+        except Exception as e:
+            self.logger.error("Ошибка при подсчёте состояний FSM: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def claim_outbox(self, limit: int, lease: float) -> list[OutboxMessage]:
+        try:
+            results = await self._fetchall(CLAIM_OUTBOX_SQL, (lease, limit))
+            return sorted((self._row_to_outbox_message(result) for result in results), key=lambda m: m.outbox_id)
+        except Exception as e:
+            self.logger.error("Ошибка при выборке исходящих сообщений: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def renew_outbox(self, outbox_ids: list[int], lease: float) -> int:
+        if not outbox_ids:
+            return 0
+        try:
+            return await self._execute(RENEW_OUTBOX_SQL, (lease, list(outbox_ids)))
+        except Exception as e:
+            self.logger.error("Ошибка при продлении аренды исходящих сообщений: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def complete_outbox(self, outbox_ids: list[int]) -> int:
+        if not outbox_ids:
+            return 0
+        try:
+            return await self._execute(COMPLETE_OUTBOX_SQL, (list(outbox_ids),))
+        except Exception as e:
+            self.logger.error("Ошибка при удалении доставленных сообщений: %s", e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def retry_outbox(self, outbox_id: int, delay: float):
+        try:
+            await self._execute(RETRY_OUTBOX_SQL, (delay, outbox_id))
+        except Exception as e:
+            self.logger.error("Ошибка при переносе отправки сообщения %s: %s", outbox_id, e)
+            raise
+
+    @timed(QUERY_SECONDS, QUERY_ERRORS)
+    async def fail_outbox(self, outbox_id: int):
+        try:
+            await self._execute(FAIL_OUTBOX_SQL, (outbox_id,))
+        except Exception as e:
+            self.logger.error("Ошибка при отметке недоставленного сообщения %s: %s", outbox_id, e)
             raise
 
-    def __del__(self):
-        self.cursor.close()
-        self.conn.close()
\ No newline at end of file
+    async def close(self):
+        self.executor.shutdown(wait=True)
+        self.pool.closeall()
+        self.logger.info("Пул подключений к базе данных закрыт")
@@ -0,0 +1,223 @@
+import asyncio
+import heapq
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from repositories.db import Repository
+from logger.logger import Logger
+
+@dataclass
+class ExpiringRecord:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    expires_at: float = 0.0
+    size: int = 0
+
+
+class ExpiringMemoryStorage(BaseStorage):
+    SWEEP_CHUNK = 1000
+
+    def __init__(self, logger: Logger, default_ttl: float = 86400.0, state_ttls: dict[str, float] = None,
+                 sweep_interval: float = 300.0):
+        self.logger = logger
+        self.default_ttl = default_ttl
+        self.state_ttls = state_ttls or {}
+        self.sweep_interval = sweep_interval
+        self.records: dict[StorageKey, ExpiringRecord] = {}
+        # Куча (expires_at, порядковый номер, ключ); записи, переписанные позже, отбрасываются при выемке.
+        self.deadlines = []
+        self.sequence = 0
+        self.bytes = 0
+        self.stats = {"evictions": 0, "expired_reads": 0, "sweeps": 0}
+
+    @property
+    def metrics(self) -> dict:
+        return {"live": len(self.records), "bytes": self.bytes, **self.stats}
+
+    @staticmethod
+    def _size(state: Optional[str], data: dict) -> int:
+        return len(state or "") + len(json.dumps(data, default=str, ensure_ascii=False).encode())
+
+    def _record(self, key: StorageKey) -> Optional[ExpiringRecord]:
+        record = self.records.get(key)
+        if record is not None and record.expires_at <= time.monotonic():
+            self._drop(key)
+            self.stats["expired_reads"] += 1
+            return None
+        return record
+
+    def _drop(self, key: StorageKey):
+        record = self.records.pop(key)
+        self.bytes -= record.size
+        self.stats["evictions"] += 1
+
+    def _write(self, key: StorageKey, state: Optional[str], data: dict):
+        old = self.records.pop(key, None)
+        if old is not None:
+            self.bytes -= old.size
+        if state is None and not data:
+            return
+        ttl = self.state_ttls.get(state, self.default_ttl)
+        record = ExpiringRecord(state, data, time.monotonic() + ttl, self._size(state, data))
+        self.records[key] = record
+        self.bytes += record.size
+        self.sequence += 1
+        heapq.heappush(self.deadlines, (record.expires_at, self.sequence, key))
+        if len(self.deadlines) > 2 * len(self.records) + 1024:
+            # Устаревшие сроки копятся при каждой перезаписи; пересобираем кучу по живым записям.
+            self.deadlines = [(record.expires_at, index, key) for index, (key, record) in enumerate(self.records.items())]
+            heapq.heapify(self.deadlines)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._record(key)
+        self._write(key, state.state if isinstance(state, State) else state, record.data if record else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._record(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._record(key)
+        self._write(key, record.state if record else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._record(key)
+        return record.data.copy() if record else {}
+
+    def sweep(self, limit: int = None) -> int:
+        now = time.monotonic()
+        evicted = 0
+        while self.deadlines and self.deadlines[0][0] <= now and (limit is None or evicted < limit):
+            expires_at, _, key = heapq.heappop(self.deadlines)
+            record = self.records.get(key)
+            if record is not None and record.expires_at == expires_at:
+                self._drop(key)
+                evicted += 1
+        self.stats["sweeps"] += 1
+        return evicted
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            evicted = 0
+            # Частями, чтобы большой сбор не блокировал обработку обновлений.
+            while True:
+                swept = self.sweep(self.SWEEP_CHUNK)
+                evicted += swept
+                if swept < self.SWEEP_CHUNK:
+                    break
+                await asyncio.sleep(0)
+            if evicted:
+                metrics = self.metrics
+                self.logger.info(
+                    "Удалено просроченных состояний FSM: %s, активных: %s, ~%s байт",
+                    evicted, metrics['live'], metrics['bytes']
+                )
+
+    async def close(self) -> None:
+        self.records.clear()
+        self.deadlines.clear()
+        self.bytes = 0
+
+
+class PostgresStorage(BaseStorage):
+    def __init__(self, repo: Repository, logger: Logger, key_builder: KeyBuilder = None,
+                 default_ttl: float = 86400.0, state_ttls: dict[str, float] = None, sweep_interval: float = 300.0):
+        self.repo = repo
+        self.logger = logger
+        self.default_ttl = default_ttl
+        self.state_ttls = state_ttls or {}
+        self.sweep_interval = sweep_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.pending = {}
+        self.stats = {"reads": 0, "batches": 0, "writes": 0}
+        self.live = None
+
+    @property
+    def metrics(self) -> dict:
+        # live обновляется раз в sweep_interval вместе с очисткой, а не на каждый запрос метрик.
+        return {"live": self.live, **self.stats}
+
+    def _key(self, key: StorageKey) -> str:
+        return self.key_builder.build(key)
+
+    async def _get_record(self, key: StorageKey) -> tuple:
+        # Чтения, пришедшие в одной итерации цикла событий, уходят в базу одним запросом:
+        # при наплыве обновлений фильтры состояний разных пользователей не ждут друг друга.
+        record_key = self._key(key)
+        self.stats["reads"] += 1
+        future = self.pending.get(record_key)
+        if future is None:
+            if not self.pending:
+                asyncio.get_running_loop().call_soon(self._schedule_flush)
+            future = asyncio.get_running_loop().create_future()
+            self.pending[record_key] = future
+        return await asyncio.shield(future)
+
+    def _schedule_flush(self):
+        pending, self.pending = self.pending, {}
+        asyncio.create_task(self._flush(pending))
+
+    async def _flush(self, pending: dict):
+        self.stats["batches"] += 1
+        try:
+            records = await self.repo.get_fsm_records(list(pending))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for record_key, future in pending.items():
+            if not future.done():
+                future.set_result(records.get(record_key, (None, {})))
+
+    async def get_many(self, keys: list[StorageKey]) -> dict[StorageKey, tuple]:
+        records = await self.repo.get_fsm_records([self._key(key) for key in keys])
+        return {key: records.get(self._key(key), (None, {})) for key in keys}
+
+    async def set_many(self, records: dict[StorageKey, tuple]):
+        self.stats["writes"] += 1
+        await self.repo.set_fsm_records({
+            self._key(key): (state.state if isinstance(state, State) else state, data)
+            for key, (state, data) in records.items()
+        })
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self.stats["writes"] += 1
+        await self.repo.set_fsm_state(self._key(key), state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get_record(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self.stats["writes"] += 1
+        await self.repo.set_fsm_data(self._key(key), data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get_record(key)
+        return dict(data)
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Слияние на стороне базы: один запрос вместо чтения и записи, и параллельные
+        # обновления с разных реплик не затирают ключи друг друга.
+        self.stats["writes"] += 1
+        return await self.repo.merge_fsm_data(self._key(key), data)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                deleted = await self.repo.delete_stale_fsm_states(self.state_ttls, self.default_ttl)
+                self.live = await self.repo.count_fsm_states()
+            except Exception as e:
+                self.logger.error("Ошибка очистки устаревших состояний FSM: %s", e)
+                continue
+            if deleted:
+                self.logger.info("Удалено устаревших состояний FSM: %s", deleted)
+
+    async def close(self) -> None:
+        pass
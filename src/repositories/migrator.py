@@ -0,0 +1,104 @@
+import hashlib
+import os
+import re
+from repositories.db import Repository
+from logger.logger import Logger
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+class Migrator:
+    # Один и тот же ключ у всех реплик: миграции применяет только та, что взяла блокировку.
+    LOCK_KEY = 7310452001
+    FILENAME = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+
+    def __init__(self, repo: Repository, logger: Logger, path: str = MIGRATIONS_PATH):
+        self.repo = repo
+        self.logger = logger
+        self.path = path
+        self.migrations = self._discover()
+
+    def _discover(self) -> list[tuple[int, str, str]]:
+        migrations = []
+        for filename in sorted(os.listdir(self.path)):
+            match = self.FILENAME.match(filename)
+            if not match:
+                continue
+            with open(os.path.join(self.path, filename), encoding="utf-8") as f:
+                migrations.append((int(match.group(1)), match.group(2), f.read()))
+        versions = [version for version, _, _ in migrations]
+        if len(versions) != len(set(versions)):
+            raise ValueError(f"Повторяющиеся номера миграций в {self.path}")
+        return sorted(migrations)
+
+    @property
+    def latest_version(self) -> int:
+        return self.migrations[-1][0] if self.migrations else 0
+
+    @staticmethod
+    def _checksum(sql: str) -> str:
+        return hashlib.sha256(sql.encode()).hexdigest()
+
+    @staticmethod
+    def _create_table(cursor):
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+            """
+        )
+
+    async def migrate(self) -> list[int]:
+        def work(cursor):
+            # Всё в одной транзакции: DDL в Postgres транзакционный, и упавшая миграция
+            # откатывается целиком вместе с записью о ней.
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (self.LOCK_KEY,))
+            # Индексы на больших таблицах строятся дольше обычного statement_timeout пула.
+            cursor.execute("SET LOCAL statement_timeout = 0")
+            self._create_table(cursor)
+            cursor.execute("SELECT version, checksum FROM schema_migrations")
+            applied = {row['version']: row['checksum'] for row in cursor.fetchall()}
+            done = []
+            for version, name, sql in self.migrations:
+                checksum = self._checksum(sql)
+                if version in applied:
+                    if applied[version] != checksum:
+                        self.logger.error("Миграция %s_%s изменена после применения", version, name)
+                    continue
+                cursor.execute(sql)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                    (version, name, checksum)
+                )
+                done.append(version)
+            return done
+        try:
+            done = await self.repo._run(work)
+        except Exception as e:
+            self.logger.error("Ошибка применения миграций: %s", e)
+            raise
+        if done:
+            self.logger.info("Применены миграции: %s", ', '.join(map(str, done)))
+        else:
+            self.logger.info("Схема базы данных актуальна (версия %s)", self.latest_version)
+        return done
+
+    async def pending(self) -> list[int]:
+        def work(cursor):
+            cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL AS exists")
+            if not cursor.fetchone()['exists']:
+                return set()
+            cursor.execute("SELECT version FROM schema_migrations")
+            return {row['version'] for row in cursor.fetchall()}
+        applied = await self.repo._run(work)
+        return [version for version, _, _ in self.migrations if version not in applied]
+
+    async def check(self):
+        pending = await self.pending()
+        if pending:
+            raise RuntimeError(
+                f"Схема базы данных устарела: не применены миграции {', '.join(map(str, pending))}"
+            )
@@ -0,0 +1,48 @@
+import copy
+import time
+from collections import OrderedDict
+from typing import Optional
+from models.user import User
+
+class UserCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[int, tuple[float, User]] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, user_id: int) -> Optional[User]:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del self.entries[user_id]
+            self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(user_id)
+        self.stats["hits"] += 1
+        # Отдаём копию: обработчики меняют объект до сохранения, а неудачное сохранение
+        # не должно оставлять в кеше несуществующее состояние.
+        return copy.copy(user)
+
+    def put(self, user: User):
+        self.entries[user.user_id] = (time.monotonic() + self.ttl, copy.copy(user))
+        self.entries.move_to_end(user.user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def update_username(self, user_id: int, username: str):
+        entry = self.entries.get(user_id)
+        if entry is not None:
+            entry[1].username = username
+
+    def invalidate(self, user_id: int):
+        if self.entries.pop(user_id, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
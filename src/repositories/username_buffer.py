@@ -0,0 +1,53 @@
+import asyncio
+from models.user import User
+from repositories.db import Repository
+from logger.logger import Logger
+
+class UsernameBuffer:
+    def __init__(self, repo: Repository, logger: Logger, flush_interval: float = 30.0, max_pending: int = 5000):
+        self.repo = repo
+        self.logger = logger
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending: dict[int, str] = {}
+        self.flush_requested = asyncio.Event()
+        self.stats = {"staged": 0, "dropped": 0, "flushed": 0, "flushes": 0}
+
+    def refresh(self, user: User, username: str):
+        if user.username == username:
+            self.stats["dropped"] += 1
+            return
+        user.username = username
+        self.repo.cache_username(user.user_id, username)
+        self.pending[user.user_id] = username
+        self.stats["staged"] += 1
+        if len(self.pending) >= self.max_pending:
+            self.flush_requested.set()
+
+    async def flush(self) -> int:
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, {}
+        try:
+            await self.repo.update_usernames(batch)
+        except Exception as e:
+            self.logger.error("Не удалось сбросить %s username в базу: %s", len(batch), e)
+            # Более свежие значения, пришедшие во время сброса, важнее старых.
+            for user_id, username in batch.items():
+                self.pending.setdefault(user_id, username)
+            return 0
+        self.stats["flushed"] += len(batch)
+        self.stats["flushes"] += 1
+        return len(batch)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            await self.flush()
+
+    async def close(self):
+        await self.flush()
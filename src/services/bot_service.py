@@ -1,37 +1,47 @@
 import asyncio
 from datetime import datetime, timedelta
-from aiogram import Bot, types
-from aiogram.exceptions import TelegramForbiddenError
+from aiogram import types
 from models.user import User
 from models.payment import Payment
+from models.response import Response
+from models.outbox_message import OutboxMessage
+from models.tariff import Tariff
 from repositories.db import Repository
 from services.crypto_service import CryptoService
+from services.expiry_scheduler import ExpiryScheduler
+from services.outbox import Outbox
+from services.tariff_catalog import TariffCatalog
+from keyboards.keyboards import KeyboardRegistry
 from logger.logger import Logger
 
 class BotService:
-    TARIFFS = {
-        "regular": {
-            "test": {"days": 1, "price": 5, "name": "Тестовый (1 день)"},
-            "1month": {"days": 30, "price": 70, "name": "1 месяц"},
-            "3months": {"days": 90, "price": 160, "name": "3 месяца (Выгода 50$)"},
-            "6months": {"days": 180, "price": 320, "name": "6 месяцев (Выгода 100$)"},
-            "12months": {"days": 365, "price": 640, "name": "12 месяцев (Выгода 200$)"}
-        },
-        "referral": {
-            "test": {"days": 1, "price": 2.5, "name": "Тестовый (1 день, реферал)"},
-            "1month": {"days": 30, "price": 35, "name": "1 месяц (реферал)"},
-            "3months": {"days": 90, "price": 80, "name": "3 месяца (реферал, Выгода 25$)"},
-            "6months": {"days": 180, "price": 160, "name": "6 месяцев (реферал, Выгода 50$)"},
-            "12months": {"days": 365, "price": 320, "name": "12 месяцев (реферал, Выгода 100$)"}
-        }
-    }
-
     SUPPORTED_EXCHANGES = ["Binance", "Bybit", "Kraken", "OKX"]
 
-    def __init__(self, repo: Repository, crypto_service: CryptoService, logger: Logger):
+    EXPIRE_BATCH_SIZE = 1000
+
+    PAYMENTS_UNAVAILABLE = "⚠️ Платёжный сервис временно недоступен. Попробуйте через несколько минут."
+
+    EXPIRED_NOTICE = Outbox.message(None, "Ваша подписка истекла. Пожалуйста, продлите её.")
+
+    def __init__(self, repo: Repository, crypto_service: CryptoService, tariffs: TariffCatalog, logger: Logger,
+                 expiry_scheduler: ExpiryScheduler, outbox: Outbox, invoice_ttl: int = 3600,
+                 invoice_reuse_margin: int = 300):
         self.repo = repo
         self.crypto_service = crypto_service
+        self.tariffs = tariffs
         self.logger = logger
+        self.expiry_scheduler = expiry_scheduler
+        self.outbox = outbox
+        self.keyboards = KeyboardRegistry(self.tariffs, self.SUPPORTED_EXCHANGES)
+        self.invoice_ttl = invoice_ttl
+        self.invoice_reuse_margin = invoice_reuse_margin
+        self.invoice_requests: dict[str, asyncio.Future] = {}
+
+    def reload_tariffs(self) -> bool:
+        if not self.tariffs.reload():
+            return False
+        self.keyboards = KeyboardRegistry(self.tariffs, self.SUPPORTED_EXCHANGES)
+        return True
 
     def get_profile_text(self, user: User) -> str:
         if not user:
@@ -60,27 +70,11 @@ class BotService:
             f"API-ключ: <b>{api_key_info}</b>"
         )
 
-    async def request_exchange(self, user_id: int, message: types.Message, bot: Bot):
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text=exchange, callback_data=f"exchange:{exchange}")]
-            for exchange in self.SUPPORTED_EXCHANGES
-        ])
-        keyboard.inline_keyboard.append([
-            types.InlineKeyboardButton(text="📞 Поддержка", callback_data="support"),
-            types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")
-        ])
-        await bot.send_message(
-            user_id,
-            "Выберите биржу, с которой вы работаете:",
-            reply_markup=keyboard
-        )
+    def get_profile_keyboard(self, user: User) -> types.InlineKeyboardMarkup:
+        return self.keyboards.profile(user)
 
-    async def request_api_key(self, user_id: int, message: types.Message, bot: Bot):
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-        ])
-        await bot.send_message(
-            user_id,
+    def api_key_prompt(self) -> Response:
+        return Response(
             "Пожалуйста, предоставьте API-ключ для выбранной биржи.\n\n"
             "🔒 <b>О безопасности:</b>\n"
             "1. Мы используем ваш API-ключ только для чтения данных (например, баланса или торговой истории).\n"
@@ -88,159 +82,193 @@ class BotService:
             "3. Мы не можем использовать ваш API-ключ для вывода средств или других действий без вашего явного разрешения.\n"
             "4. Убедитесь, что ваш API-ключ настроен только с правами на чтение (без прав на торговлю или вывод).\n\n"
             "Введите API-ключ:",
-            parse_mode="HTML",
-            reply_markup=keyboard
+            self.keyboards.main_menu
         )
 
-    async def save_exchange_and_api(self, user_id: int, exchange: str, api_key: str, username: str = None):
-        user = self.repo.get_user(user_id) or User(user_id=user_id, username=username)
-        user.exchange = exchange
-        user.api_key = api_key
-        user.username = username or user.username
-        self.logger.info(f"Попытка сохранить данные пользователя: user_id={user_id}, exchange={exchange}, api_key={api_key}, username={user.username}")
+    async def save_exchange_and_api(self, user: User, exchange: str, api_key: str) -> User:
+        self.logger.debug("Попытка сохранить биржу пользователя: user_id=%s, exchange=%s", user.user_id, exchange)
         try:
-            self.repo.save_user(user)
-            self.logger.info(f"Данные пользователя {user_id} успешно сохранены")
+            user = await self.repo.set_exchange(user, exchange, api_key)
+            self.logger.debug("Данные пользователя %s успешно сохранены", user.user_id)
         except Exception as e:
-            self.logger.error(f"Ошибка сохранения биржи и API для {user_id}: {str(e)}")
+            self.logger.error("Ошибка сохранения биржи и API для %s: %s", user.user_id, e)
             raise
+        return user
 
-    async def process_payment(self, user_id: int, tariff_id: str, message: types.Message, bot: Bot):
-        user = self.repo.get_user(user_id)
-        subscription_type = user.subscription_type if user and user.subscription_type else "regular"
-        tariff = self.TARIFFS[subscription_type].get(tariff_id)
-        if not tariff:
-            await message.answer("Неверный тариф.")
-            return
+    def _invoice_key(self, user_id: int, tariff: Tariff) -> str:
+        return f"{user_id}:{tariff.subscription_type}:{tariff.tariff_id}:{tariff.price_cents}"
 
-        invoice = self.crypto_service.create_invoice(user_id, tariff["price"], tariff["name"])
+    async def _get_or_create_invoice(self, key: str, user_id: int, tariff: Tariff) -> Payment:
+        payment = await self.repo.get_open_payment(key)
+        if payment is not None:
+            reusable_after = datetime.now() - timedelta(seconds=self.invoice_ttl - self.invoice_reuse_margin)
+            if payment.created_at and payment.created_at > reusable_after and payment.pay_url:
+                self.logger.info("Повторно используется инвойс %s для %s", payment.invoice_id, key)
+                return payment
+            await self.repo.release_idempotency_key(payment.invoice_id)
+
+        invoice = await self.crypto_service.create_invoice(
+            user_id, tariff.price, tariff.name, self.invoice_ttl, self.tariffs.encode_payload(user_id, tariff)
+        )
         if not invoice or not invoice.get("ok") or "result" not in invoice:
             self.logger.error("Ошибка создания инвойса")
-            await message.answer("Ошибка при создании платежа. Попробуйте позже.")
-            return
-
-        invoice_id = invoice["result"]["invoice_id"]
-        pay_url = invoice["result"]["pay_url"]
-
+            return None
         payment = Payment(
-            invoice_id=invoice_id,
+            invoice_id=invoice["result"]["invoice_id"],
             user_id=user_id,
-            amount=tariff["price"],
+            amount=tariff.price,
             currency="USDT",
-            status="created"
+            status="created",
+            tariff_id=tariff.tariff_id,
+            pay_url=invoice["result"]["pay_url"],
+            created_at=datetime.now(),
+            idempotency_key=key
         )
+        saved = await self.repo.save_payment(payment)
+        if saved is None:
+            # Другая реплика успела раньше; наш инвойс просто истечёт в Crypto Pay.
+            return await self.repo.get_open_payment(key)
+        return saved
+
+    async def process_payment(self, user: User, tariff_id: str) -> Response:
+        user_id = user.user_id
+        subscription_type = user.subscription_type or "regular"
+        tariff = self.tariffs.get(subscription_type, tariff_id)
+        if not tariff:
+            return Response(notice="Неверный тариф.", success=False)
+
+        key = self._invoice_key(user_id, tariff)
+        request = self.invoice_requests.get(key)
+        if request is not None:
+            # Повторное нажатие, пока первое ещё создаёт инвойс: ссылку покажет первое.
+            await asyncio.wait([request])
+            return Response(success=False)
+        request = asyncio.ensure_future(self._get_or_create_invoice(key, user_id, tariff))
+        self.invoice_requests[key] = request
         try:
-            self.repo.save_payment(payment)
+            payment = await asyncio.shield(request)
         except Exception as e:
-            self.logger.error(f"Ошибка сохранения платежа: {e}")
-            await message.answer("Ошибка при сохранении платежа.")
-            return
-
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="✅ Проверить оплату", callback_data=f"check_payment:{tariff_id}")],
-            [types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-        ])
-        await bot.send_message(
-            user_id,
-            f"💳 Оплатите {tariff['price']}$ за тариф <b>{tariff['name']}</b>\n"
-            f"🔗 <a href='{pay_url}'>Ссылка для оплаты</a>\n\n"
+            self.logger.error("Ошибка сохранения платежа: %s", e)
+            return Response(notice="Ошибка при сохранении платежа.", success=False)
+        finally:
+            self.invoice_requests.pop(key, None)
+        if payment is None:
+            if not self.crypto_service.available:
+                return Response(notice=self.PAYMENTS_UNAVAILABLE, success=False)
+            return Response(notice="Ошибка при создании платежа. Попробуйте позже.", success=False)
+
+        # Меню тарифов превращается в счёт на месте, без нового сообщения и удаления старого.
+        return Response(
+            f"💳 Оплатите {tariff.price}$ за тариф <b>{tariff.name}</b>\n"
+            f"🔗 <a href='{payment.pay_url}'>Ссылка для оплаты</a>\n\n"
             f"После оплаты нажмите кнопку ниже:",
-            parse_mode="HTML",
-            reply_markup=keyboard
+            self.keyboards.payment_check(tariff_id)
         )
-        await message.delete()
 
-    async def check_payment(self, user_id: int, message: types.Message, bot: Bot, username: str = None, tariff_id: str = None):
-        payment = self.repo.get_last_payment(user_id)
+    async def check_payment(self, user: User, tariff_id: str = None, message_id: int = None) -> Response:
+        # Пока оплата не подтверждена, экран со ссылкой и кнопкой проверки не меняется —
+        # ответ приходит уведомлением. После подтверждения тот же экран становится профилем.
+        user_id = user.user_id
+        payment = await self.repo.get_last_payment(user_id)
         if not payment:
-            await message.answer("У вас нет активных платежей для проверки.")
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-            ])
-            await message.answer("Вернитесь в главное меню:", reply_markup=keyboard)
-            return
-
-        invoice = self.crypto_service.check_invoice(payment.invoice_id)
+            return Response(notice="У вас нет активных платежей для проверки.")
+
+        invoice = await self.crypto_service.check_invoice(payment.invoice_id)
+        if invoice is None and not self.crypto_service.available:
+            # Предохранитель открыт: запрос не отправлялся, отвечаем сразу и без лишних ошибок в логе.
+            return Response(notice=self.PAYMENTS_UNAVAILABLE)
         if not invoice or not invoice.get("ok") or not invoice["result"]["items"]:
             self.logger.error("Ошибка проверки статуса платежа")
-            await message.answer("Ошибка при проверке статуса платежа. Попробуйте позже.")
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-            ])
-            await message.answer("Вернитесь в главное меню:", reply_markup=keyboard)
-            return
+            return Response(notice="Ошибка при проверке статуса платежа. Попробуйте позже.")
 
         if invoice["result"]["items"][0]["status"] != "paid":
-            await message.answer("Платеж еще не подтвержден. Попробуйте снова.")
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🏠 Главое меню", callback_data="main_menu")]
-            ])
-            await message.answer("Вернитесь в главное меню:", reply_markup=keyboard)
-            return
-
-        amount = float(invoice["result"]["items"][0]["amount"])
-        self.logger.info(f"Полученная сумма платежа: {amount}, tariff_id: {tariff_id}")
-        user = self.repo.get_user(user_id)
-        subscription_type = user.subscription_type if user and user.subscription_type else "regular"
-        tariff_id = next((tid for tid, t in self.TARIFFS[subscription_type].items() if abs(t["price"] - amount) < 0.01), None)
-        if not tariff_id:
-            self.logger.error(f"Ошибка определения тарифа для суммы: {amount}")
-            await message.answer("Ошибка определения тарифа. Свяжитесь с поддержкой.")
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-            ])
-            await message.answer("Вернитесь в главное меню:", reply_markup=keyboard)
-            return
-
-        current = datetime.now()
-        if user and user.subscription_end and user.subscription_end > current:
-            current = user.subscription_end
-
-        new_end = current + timedelta(days=self.TARIFFS[subscription_type][tariff_id]["days"])
-        user = User(
-            user_id=user_id,
-            subscription_end=new_end,
-            exchange=user.exchange if user else None,
-            api_key=user.api_key if user else None,
-            username=username or (user.username if user else None),
-            is_referral=user.is_referral if user else False,
-            subscription_type=subscription_type
-        )
+            return Response(notice="Платеж еще не подтвержден. Попробуйте снова.")
+
         try:
-            self.repo.save_user(user)
-            self.repo.update_payment_status(payment.invoice_id, "paid")
+            updated = await self.confirm_invoice(invoice["result"]["items"][0], user, message_id)
+        except ValueError as e:
+            self.logger.error(str(e))
+            return Response(notice="Ошибка определения тарифа. Свяжитесь с поддержкой.")
         except Exception as e:
-            self.logger.error(f"Ошибка обновления подписки: {e}")
-            await message.answer("Ошибка при обновлении подписки.")
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-            ])
-            await message.answer("Вернитесь в главное меню:", reply_markup=keyboard)
-            return
-
-        await message.answer(
-            f"✅ Оплата подтверждена! Ваша подписка активна до: <b>{new_end.strftime('%Y-%m-%d %H:%M:%S')}</b>",
-            parse_mode="HTML"
+            self.logger.error("Ошибка обновления подписки: %s", e)
+            return Response(notice="Ошибка при обновлении подписки.")
+
+        if updated is None:
+            # Платёж уже применён вебхуком или предыдущим нажатием — показываем актуальный профиль.
+            user = await self.repo.get_user(user_id) or user
+            return self.profile_response(user, "✅ Оплата уже подтверждена.")
+        # Экран с подтверждением записан в outbox вместе с оплатой и заменит сообщение
+        # message_id; здесь остаётся только ответить на нажатие.
+        return Response()
+
+    def profile_response(self, user: User, header: str) -> Response:
+        # Заголовок и профиль — одним сообщением; клавиатура профиля сама предлагает
+        # выбрать биржу, если она ещё не указана.
+        text = f"{header}\n\n{self.get_profile_text(user)}"
+        if user.subscription_type and not user.exchange:
+            text += "\n\nВыберите биржу, с которой вы работаете:"
+        return Response(text, self.get_profile_keyboard(user))
+
+    def payment_confirmation(self, user: User, edit_message_id: int = None) -> OutboxMessage:
+        response = self.profile_response(
+            user,
+            f"✅ Оплата подтверждена! Ваша подписка активна до: <b>{user.subscription_end.strftime('%Y-%m-%d %H:%M:%S')}</b>"
+        )
+        options = {"parse_mode": "HTML", "reply_markup": response.reply_markup}
+        if edit_message_id is not None:
+            options["edit_message_id"] = edit_message_id
+        return Outbox.message(user.user_id, response.text, **options)
+
+    async def confirm_invoice(self, invoice: dict, user: User = None, edit_message_id: int = None) -> User:
+        # Подтверждение пользователю пишется в outbox в одной транзакции с оплатой: оно не
+        # потеряется ни при падении процесса, ни при повторной доставке вебхука, когда
+        # apply_payment уже ничего не меняет.
+        # Без номера или суммы инвойс не применить: ValueError вызывающие логируют и подтверждают
+        # получение, иначе Crypto Pay бесконечно повторял бы доставку того же вебхука.
+        missing = [field for field in ("invoice_id", "amount") if invoice.get(field) is None]
+        if missing:
+            raise ValueError(f"В инвойсе нет полей {', '.join(missing)}: {invoice.get('invoice_id')}")
+        try:
+            user_id, subscription_type, tariff_id = self.tariffs.decode_payload(invoice.get("payload"))
+        except ValueError:
+            if user is None:
+                raise
+            user_id, subscription_type, tariff_id = user.user_id, None, None
+        self.logger.info("Полученная сумма платежа: %s, invoice_id: %s", invoice['amount'], invoice['invoice_id'])
+        tariff = self.tariffs.get(subscription_type, tariff_id) if tariff_id else None
+        if tariff is None:
+            # Инвойсы, выставленные до появления тарифа в payload: тариф определяется по сумме.
+            if user is None or user.user_id != user_id:
+                user = await self.repo.get_user(user_id) or User(user_id=user_id)
+            tariff = self.tariffs.find_by_amount(user.subscription_type or "regular", invoice["amount"])
+        if tariff is None:
+            raise ValueError(f"Ошибка определения тарифа для суммы: {invoice['amount']}")
+        updated = await self.repo.apply_payment(
+            invoice["invoice_id"], user_id, tariff.days, tariff.subscription_type,
+            lambda paid: self.payment_confirmation(paid, edit_message_id)
         )
-        profile_text = self.get_profile_text(user)
-        keyboard = self.get_profile_keyboard(user)
-        await bot.send_message(user_id, profile_text, parse_mode="HTML", reply_markup=keyboard)
-        
-        if not user.exchange:
-            await self.request_exchange(user_id, message, bot)
-
-    async def check_subscriptions(self, bot: Bot):
+        if updated is not None:
+            self.expiry_scheduler.notify(updated.subscription_end)
+            self.outbox.wake()
+        return updated
+
+    async def expire_subscriptions(self) -> int:
+        total = 0
+        while True:
+            # Уведомления пишутся в outbox той же транзакцией, что удаляет пользователей.
+            expired_users = await self.repo.expire_users(self.EXPIRE_BATCH_SIZE, self.EXPIRED_NOTICE)
+            if not expired_users:
+                break
+            self.outbox.wake()
+            total += len(expired_users)
+            if len(expired_users) < self.EXPIRE_BATCH_SIZE:
+                break
+        return total
+
+    async def check_subscriptions(self):
         while True:
             try:
-                expired_users = self.repo.get_expired_users()
-                for user in expired_users:
-                    try:
-                        await bot.send_message(user.user_id, "Ваша подписка истекла. Пожалуйста, продлите её.")
-                    except TelegramForbiddenError:
-                        self.logger.error(f"Бот заблокирован пользователем {user.user_id}")
-                    except Exception as e:
-                        self.logger.error(f"Ошибка отправки сообщения пользователю {user.user_id}: {e}")
-                    self.repo.delete_user(user.user_id)
+                await self.expire_subscriptions()
             except Exception as e:
-                self.logger.error(f"Ошибка проверки подписок: {e}")
-            await asyncio.sleep(3600)
\ No newline at end of file
+                self.logger.error("Ошибка проверки подписок: %s", e)
+            await self.expiry_scheduler.wait_next()
@@ -0,0 +1,77 @@
+import time
+from metrics.metrics import REGISTRY
+from logger.logger import Logger
+
+STATE = REGISTRY.gauge("circuit_breaker_state", "Состояние предохранителя: 0 — закрыт, 1 — полуоткрыт, 2 — открыт", ("name",))
+TRANSITIONS = REGISTRY.counter("circuit_breaker_transitions_total", "Переходы предохранителя", ("name", "state"))
+REJECTED = REGISTRY.counter("circuit_breaker_rejected_total", "Вызовы, отклонённые открытым предохранителем", ("name",))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, logger: Logger, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 half_open_calls: int = 1):
+        self.name = name
+        self.logger = logger
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        STATE.set(0, name)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        log = self.logger.error if state == self.OPEN else self.logger.info
+        log("Предохранитель %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        STATE.set(self.STATE_VALUES[state], self.name)
+        TRANSITIONS.inc(self.name, state)
+
+    @property
+    def available(self) -> bool:
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        if self.state == self.HALF_OPEN:
+            return self.probes < self.half_open_calls
+        return True
+
+    def before_call(self):
+        # Пока предохранитель открыт, вызов отклоняется сразу, не занимая соединение и не
+        # дожидаясь таймаута. По истечении reset_timeout пропускаются half_open_calls пробных
+        # вызовов: их результат решает, закрыться или открыться снова.
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._transition(self.HALF_OPEN)
+            self.probes = 0
+        if self.state == self.OPEN or (self.state == self.HALF_OPEN and self.probes >= self.half_open_calls):
+            REJECTED.inc(self.name)
+            raise CircuitOpenError(f"{self.name} недоступен")
+        if self.state == self.HALF_OPEN:
+            self.probes += 1
+
+    def record_success(self):
+        self.failures = 0
+        if self.state == self.HALF_OPEN:
+            self._transition(self.CLOSED)
+
+    def release(self):
+        # Вызов прерван (отмена задачи) и ничего не сказал о состоянии сервиса.
+        if self.state == self.HALF_OPEN and self.probes > 0:
+            self.probes -= 1
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
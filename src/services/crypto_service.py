@@ -1,37 +1,237 @@
-import requests 
+import asyncio
+import random
+import time
+from collections import OrderedDict
+from typing import Optional
+import aiohttp
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from metrics.metrics import REGISTRY
 from logger.logger import Logger
 
+REQUEST_SECONDS = REGISTRY.histogram(
+    "crypto_pay_request_duration_seconds", "Время HTTP-запросов к Crypto Pay (каждая попытка отдельно)", ("method", "status")
+)
+RETRIES = REGISTRY.counter("crypto_pay_retries_total", "Повторные запросы к Crypto Pay", ("method",))
+STATUS_LOOKUPS = REGISTRY.counter(
+    "crypto_pay_invoice_status_total", "Проверки статуса инвойса: из кеша, присоединённые к запросу или новые", ("result",)
+)
+
 class CryptoService:
-    def __init__(self, token: str, logger: Logger):
+    API_URL = "https://pay.crypt.bot/api"
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    TERMINAL_STATUSES = {"paid", "expired"}
+
+    def __init__(self, token: str, logger: Logger, api_url: str = API_URL, connect_timeout: float = 3.0,
+                 read_timeout: float = 10.0, max_connections: int = 20, max_concurrency: int = 10,
+                 retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 5.0,
+                 status_ttl: float = 3.0, status_cache_size: int = 10000, breaker_failures: int = 5,
+                 breaker_reset_timeout: float = 30.0, breaker_half_open_calls: int = 1):
         self.token = token
         self.logger = logger
+        self.api_url = api_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_connections = max_connections
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = None
+        self.breaker = CircuitBreaker(
+            "crypto_pay", logger, breaker_failures, breaker_reset_timeout, breaker_half_open_calls
+        )
+        # Статус инвойса: активный живёт status_ttl секунд, оплаченный и просроченный уже не
+        # изменятся и хранятся до вытеснения (LRU на status_cache_size инвойсов).
+        self.status_ttl = status_ttl
+        self.status_cache_size = status_cache_size
+        self.status_cache: OrderedDict[int, tuple[Optional[float], dict]] = OrderedDict()
+        self.inflight: dict[int, asyncio.Future] = {}
+        self.stats = {"cache_hits": 0, "coalesced": 0, "requests": 0}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"Crypto-Pay-API-Token": self.token}
+            )
+        return self.session
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _attempt(self, method: str, url: str, params: dict, attempt: int) -> dict:
+        async with self.semaphore:
+            started = time.perf_counter()
+            status = "error"
+            try:
+                async with self._get_session().get(url, params=params) as response:
+                    status = response.status
+                    if response.status in self.RETRY_STATUSES and attempt < self.retries:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status
+                        )
+                    response.raise_for_status()
+                    return await response.json()
+            except asyncio.TimeoutError:
+                status = "timeout"
+                raise
+            finally:
+                REQUEST_SECONDS.observe(time.perf_counter() - started, method, status)
+
+    async def _request(self, method: str, params: dict, idempotent: bool = True) -> dict:
+        url = f"{self.api_url}/{method}"
+        params = {key: str(value) for key, value in params.items()}
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await self._attempt(method, url, params, attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Ответ 4xx значит, что сервис работает, — предохранитель его не считает.
+                if isinstance(e, aiohttp.ClientResponseError) and e.status not in self.RETRY_STATUSES:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                # Создание инвойса не идемпотентно: повторяем его только если запрос
+                # гарантированно не дошёл до сервера (ошибка соединения или 429).
+                if isinstance(e, aiohttp.ClientResponseError):
+                    retriable = e.status in self.RETRY_STATUSES and (idempotent or e.status == 429)
+                elif isinstance(e, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)):
+                    retriable = True
+                else:
+                    retriable = idempotent
+                if not retriable or attempt >= self.retries or not self.breaker.available:
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                RETRIES.inc(method)
+                self.logger.info("Повтор запроса %s через %.2f с (попытка %s): %s: %s", method, delay, attempt, type(e).__name__, e)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
 
-    def create_invoice(self, user_id: int, amount: float, description: str) -> dict:
-        url = "https://pay.crypt.bot/api/createInvoice"
-        headers = {"Crypto-Pay-API-Token": self.token}
+    @property
+    def available(self) -> bool:
+        return self.breaker.available
+
+    async def create_invoice(self, user_id: int, amount: float, description: str, expires_in: int = None,
+                             payload: str = None) -> dict:
         params = {
             "asset": "USDT",
             "amount": amount,
             "description": description,
             "hidden_message": "Спасибо за оплату!",
-            "payload": f"user_{user_id}"
+            "payload": payload or f"user_{user_id}"
         }
+        if expires_in:
+            params["expires_in"] = expires_in
+        try:
+            return await self._request("createInvoice", params, idempotent=False)
+        except CircuitOpenError:
+            self.logger.debug("Создание инвойса отклонено: Crypto Pay недоступен")
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error("Ошибка создания инвойса: %s: %s", type(e).__name__, e)
+            return None
+
+    @staticmethod
+    def _invoice_response(items: list[dict]) -> dict:
+        return {"ok": True, "result": {"items": items}}
+
+    def _cached_invoice(self, invoice_id: int) -> Optional[dict]:
+        entry = self.status_cache.get(invoice_id)
+        if entry is None:
+            return None
+        expires_at, invoice = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.status_cache[invoice_id]
+            return None
+        self.status_cache.move_to_end(invoice_id)
+        return invoice
+
+    def remember_invoice(self, invoice: dict):
+        if "invoice_id" not in invoice or "status" not in invoice:
+            return
+        terminal = invoice["status"] in self.TERMINAL_STATUSES
+        self.status_cache[invoice["invoice_id"]] = (None if terminal else time.monotonic() + self.status_ttl, invoice)
+        self.status_cache.move_to_end(invoice["invoice_id"])
+        if len(self.status_cache) > self.status_cache_size:
+            self.status_cache.popitem(last=False)
+
+    async def _fetch_invoice(self, invoice_id: int) -> dict:
         try:
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            self.logger.error(f"Ошибка создания инвойса: {e}")
+            response = await self._request("getInvoices", {"invoice_ids": invoice_id})
+        except CircuitOpenError:
+            self.logger.debug("Проверка инвойса %s отклонена: Crypto Pay недоступен", invoice_id)
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error("Ошибка проверки инвойса %s: %s: %s", invoice_id, type(e).__name__, e)
             return None
+        if response and response.get("ok"):
+            for invoice in response["result"]["items"]:
+                self.remember_invoice(invoice)
+        return response
 
-    def check_invoice(self, invoice_id: int) -> dict:
-        url = "https://pay.crypt.bot/api/getInvoices"
-        headers = {"Crypto-Pay-API-Token": self.token}
-        params = {"invoice_ids": invoice_id}
+    async def check_invoice(self, invoice_id: int) -> dict:
+        invoice = self._cached_invoice(invoice_id)
+        if invoice is not None:
+            self.stats["cache_hits"] += 1
+            STATUS_LOOKUPS.inc("cache_hit")
+            return self._invoice_response([invoice])
+        # Одновременные проверки одного инвойса (двойное нажатие, сверка) ждут один запрос.
+        request = self.inflight.get(invoice_id)
+        if request is not None:
+            self.stats["coalesced"] += 1
+            STATUS_LOOKUPS.inc("coalesced")
+        else:
+            self.stats["requests"] += 1
+            STATUS_LOOKUPS.inc("request")
+            request = asyncio.ensure_future(self._fetch_invoice(invoice_id))
+            self.inflight[invoice_id] = request
+            request.add_done_callback(lambda _: self._forget_request(invoice_id, request))
+        return await asyncio.shield(request)
+
+    def _forget_request(self, invoice_id: int, request: asyncio.Future):
+        if self.inflight.get(invoice_id) is request:
+            del self.inflight[invoice_id]
+
+    async def get_invoices(self, invoice_ids: list[int]) -> dict:
+        params = {"invoice_ids": ",".join(str(invoice_id) for invoice_id in invoice_ids), "count": len(invoice_ids)}
+        # Пакетный запрос сверки тоже регистрируется как выполняющийся для каждого своего
+        # инвойса: проверка пользователем в этот момент дождётся его, а не пойдёт в API.
+        loop = asyncio.get_running_loop()
+        waiters = {}
+        for invoice_id in invoice_ids:
+            if invoice_id not in self.inflight:
+                waiters[invoice_id] = self.inflight[invoice_id] = loop.create_future()
+        response = None
         try:
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            self.logger.error(f"Ошибка проверки инвойса {invoice_id}: {e}")
-            return None
\ No newline at end of file
+            response = await self._request("getInvoices", params)
+            return response
+        except CircuitOpenError:
+            self.logger.debug("Получение %s инвойсов отклонено: Crypto Pay недоступен", len(invoice_ids))
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error("Ошибка получения %s инвойсов: %s: %s", len(invoice_ids), type(e).__name__, e)
+            return None
+        finally:
+            found = {}
+            if response and response.get("ok"):
+                for invoice in response["result"]["items"]:
+                    self.remember_invoice(invoice)
+                    found[invoice["invoice_id"]] = invoice
+            for invoice_id, waiter in waiters.items():
+                self._forget_request(invoice_id, waiter)
+                if response is None or not response.get("ok"):
+                    waiter.set_result(response)
+                else:
+                    waiter.set_result(self._invoice_response([found[invoice_id]] if invoice_id in found else []))
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
@@ -0,0 +1,50 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+from repositories.db import Repository
+from logger.logger import Logger
+
+class ExpiryScheduler:
+    def __init__(self, repo: Repository, logger: Logger, min_sleep: float = 1.0, max_sleep: float = 3600.0,
+                 retry_delay: float = 30.0):
+        self.repo = repo
+        self.logger = logger
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.retry_delay = retry_delay
+        self.next_expiry: Optional[datetime] = None
+        self.wakeup = asyncio.Event()
+
+    @property
+    def lag(self) -> float:
+        # Насколько просрочено ближайшее окончание подписки, которое ещё не обработано.
+        if self.next_expiry is None:
+            return 0.0
+        return max(0.0, (datetime.now() - self.next_expiry).total_seconds())
+
+    def notify(self, subscription_end: datetime):
+        if subscription_end is None:
+            return
+        if self.next_expiry is None or subscription_end < self.next_expiry:
+            self.logger.info("Ближайшее окончание подписки перенесено на %s", subscription_end)
+            self.next_expiry = subscription_end
+            self.wakeup.set()
+
+    async def wait_next(self):
+        # Сбрасываем событие до запроса: notify(), пришедший во время запроса, не потеряется.
+        self.wakeup.clear()
+        try:
+            self.next_expiry = await self.repo.get_next_subscription_end()
+            if self.next_expiry is None:
+                delay = self.max_sleep
+            else:
+                delay = (self.next_expiry - datetime.now()).total_seconds()
+        except Exception as e:
+            self.logger.error("Ошибка планирования проверки подписок: %s", e)
+            delay = self.retry_delay
+        delay = min(max(delay, self.min_sleep), self.max_sleep)
+        self.logger.info("Следующая проверка подписок через %.0f с", delay)
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
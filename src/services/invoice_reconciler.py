@@ -0,0 +1,63 @@
+import asyncio
+from repositories.db import Repository
+from services.bot_service import BotService
+from services.crypto_service import CryptoService
+from logger.logger import Logger
+
+class InvoiceReconciler:
+    MAX_BATCH_SIZE = 1000
+
+    def __init__(self, repo: Repository, crypto_service: CryptoService, bot_service: BotService, logger: Logger,
+                 batch_size: int = 100, interval: float = 60.0):
+        self.repo = repo
+        self.crypto_service = crypto_service
+        self.bot_service = bot_service
+        self.logger = logger
+        self.batch_size = min(batch_size, self.MAX_BATCH_SIZE)
+        self.interval = interval
+
+    async def reconcile(self) -> dict:
+        stats = {"checked": 0, "paid": 0, "expired": 0}
+        if not self.crypto_service.available:
+            self.logger.info("Сверка инвойсов пропущена: Crypto Pay недоступен")
+            return stats
+        after_invoice_id = 0
+        while True:
+            payments = await self.repo.get_pending_payments(after_invoice_id, self.batch_size)
+            if not payments:
+                break
+            after_invoice_id = payments[-1].invoice_id
+            response = await self.crypto_service.get_invoices([payment.invoice_id for payment in payments])
+            if not response or not response.get("ok"):
+                self.logger.error("Сверка инвойсов прервана: Crypto Pay не вернул статусы")
+                break
+            stats["checked"] += len(payments)
+
+            expired = []
+            for invoice in response["result"]["items"]:
+                if invoice["status"] == "paid":
+                    try:
+                        user = await self.bot_service.confirm_invoice(invoice)
+                    except ValueError as e:
+                        self.logger.error("Не удалось применить инвойс %s: %s", invoice['invoice_id'], e)
+                        continue
+                    if user is not None:
+                        stats["paid"] += 1
+                elif invoice["status"] == "expired":
+                    expired.append(invoice["invoice_id"])
+            if expired:
+                stats["expired"] += await self.repo.update_payment_statuses(expired, "expired")
+
+            if len(payments) < self.batch_size:
+                break
+        if stats["checked"]:
+            self.logger.info("Сверка инвойсов: %s", stats)
+        return stats
+
+    async def run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                self.logger.error("Ошибка сверки инвойсов: %s", e)
+            await asyncio.sleep(self.interval)
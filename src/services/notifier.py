@@ -0,0 +1,56 @@
+import asyncio
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter, TelegramBadRequest
+from services.rate_limiter import TokenBucket, KeyedTokenBuckets
+from logger.logger import Logger
+
+class Notifier:
+    def __init__(self, bot: Bot, logger: Logger, global_rate: float = 25.0, per_chat_rate: float = 1.0,
+                 max_retries: int = 3, per_chat_burst: float = 1.0):
+        self.bot = bot
+        self.logger = logger
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = KeyedTokenBuckets(per_chat_rate, per_chat_burst)
+        self.max_retries = max_retries
+        self.resume_at = 0.0
+
+    async def _wait_flood(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send(self, chat_id: int, text: str, edit_message_id: int = None, **kwargs) -> str:
+        # С edit_message_id сообщение правится на месте, а не отправляется заново.
+        for attempt in range(self.max_retries + 1):
+            await self._wait_flood()
+            await self.chat_buckets.acquire(chat_id)
+            await self.global_bucket.acquire()
+            try:
+                if edit_message_id is not None:
+                    await self.bot.edit_message_text(text, chat_id=chat_id, message_id=edit_message_id, **kwargs)
+                else:
+                    await self.bot.send_message(chat_id, text, **kwargs)
+                return "sent"
+            except TelegramRetryAfter as e:
+                # Flood wait у Telegram действует на весь бот, поэтому приостанавливаем все воркеры.
+                self.logger.error("Telegram попросил подождать %s с (чат %s)", e.retry_after, chat_id)
+                self.resume_at = max(self.resume_at, time.monotonic() + e.retry_after)
+            except TelegramForbiddenError:
+                self.logger.error("Бот заблокирован пользователем %s", chat_id)
+                return "blocked"
+            except TelegramBadRequest as e:
+                if edit_message_id is not None:
+                    if "message is not modified" in e.message:
+                        return "sent"
+                    # Сообщение удалено или слишком старое для правки — отправляем новое.
+                    self.logger.debug("Правка сообщения %s в чате %s не удалась: %s", edit_message_id, chat_id, e)
+                    edit_message_id = None
+                    continue
+                self.logger.error("Ошибка отправки сообщения пользователю %s: %s", chat_id, e)
+                return "failed"
+            except Exception as e:
+                self.logger.error("Ошибка отправки сообщения пользователю %s: %s", chat_id, e)
+                if attempt < self.max_retries:
+                    await asyncio.sleep(2 ** attempt)
+        return "failed"
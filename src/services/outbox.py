@@ -0,0 +1,194 @@
+import asyncio
+import time
+from collections import deque
+from aiogram import types
+from models.outbox_message import OutboxMessage
+from repositories.db import Repository
+from services.notifier import Notifier
+from metrics.metrics import REGISTRY
+from logger.logger import Logger
+
+MESSAGES = REGISTRY.counter("outbox_messages_total", "Исходящие сообщения по результату", ("kind", "result"))
+DELIVERY_SECONDS = REGISTRY.histogram(
+    "outbox_delivery_seconds", "Время от постановки сообщения в очередь до доставки", ("kind",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+
+
+class Outbox:
+    # Исходящие сообщения уходят через пул воркеров, а обработчик не ждёт Telegram.
+    # Обычные сообщения живут только в памяти. Важные (подтверждение оплаты, истечение
+    # подписки) Repository пишет в таблицу outbox в той же транзакции, что и само изменение;
+    # отсюда их забирает опрос, и строка удаляется после доставки. Так они переживают
+    # перезапуск; доставка «хотя бы один раз»: упавший процесс может повторить отправленное.
+    # Сообщения одного чата отправляются строго по очереди, лимиты и RetryAfter — в Notifier.
+
+    def __init__(self, repo: Repository, notifier: Notifier, logger: Logger, workers: int = 20,
+                 queue_size: int = 10000, batch_size: int = 100, poll_interval: float = 5.0, lease: float = 60.0,
+                 max_attempts: int = 10, retry_delay: float = 5.0, max_retry_delay: float = 600.0):
+        self.repo = repo
+        self.notifier = notifier
+        self.logger = logger
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # Очередь сообщений по чатам и очередь чатов, готовых к отправке: чат стоит в ready,
+        # только пока ни один воркер не занят его сообщением.
+        self.chats: dict[int, deque] = {}
+        self.ready = asyncio.Queue()
+        self.pending = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        # Строки outbox, взятые в аренду этим процессом, и время последнего продления.
+        self.leased: dict[int, float] = {}
+        self.completed: list[int] = []
+        self.wakeup = asyncio.Event()
+
+    @staticmethod
+    def message(chat_id: int, text: str, **kwargs) -> OutboxMessage:
+        # Важное сообщение для записи в таблицу: клавиатура сохраняется как JSON.
+        markup = kwargs.get("reply_markup")
+        if markup is not None and not isinstance(markup, dict):
+            kwargs = dict(kwargs, reply_markup=markup.model_dump(exclude_none=True))
+        return OutboxMessage(chat_id, text, kwargs, critical=True)
+
+    @staticmethod
+    def _kwargs(options: dict) -> dict:
+        markup = options.get("reply_markup")
+        if isinstance(markup, dict):
+            return dict(options, reply_markup=types.InlineKeyboardMarkup.model_validate(markup))
+        return options
+
+    def _push(self, message: OutboxMessage):
+        queue = self.chats.get(message.chat_id)
+        if queue is None:
+            queue = self.chats[message.chat_id] = deque()
+            self.ready.put_nowait(message.chat_id)
+        queue.append(message)
+        self.pending += 1
+        self.idle.clear()
+        if message.outbox_id is not None:
+            self.leased[message.outbox_id] = time.monotonic()
+
+    def wake(self):
+        # В таблице появились новые строки: забрать их сейчас, не дожидаясь poll_interval.
+        self.wakeup.set()
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        if self.pending >= self.queue_size:
+            MESSAGES.inc("regular", "dropped")
+            self.logger.error("Очередь исходящих переполнена: сообщение для чата %s отброшено", chat_id)
+            return False
+        self._push(OutboxMessage(chat_id, text, kwargs, created_at=time.time()))
+        return True
+
+    async def _deliver(self, message: OutboxMessage):
+        kind = "critical" if message.critical else "regular"
+        result = await self.notifier.send(message.chat_id, message.text, **self._kwargs(message.options))
+        if message.outbox_id is not None:
+            self.leased.pop(message.outbox_id, None)
+            if result == "failed" and message.attempts < self.max_attempts:
+                delay = min(self.retry_delay * 2 ** (message.attempts - 1), self.max_retry_delay)
+                await self.repo.retry_outbox(message.outbox_id, delay)
+                MESSAGES.inc(kind, "retry")
+                return
+            if result == "failed":
+                self.logger.error("Сообщение %s для чата %s не доставлено после %s попыток",
+                                  message.outbox_id, message.chat_id, message.attempts)
+                await self.repo.fail_outbox(message.outbox_id)
+            else:
+                self.completed.append(message.outbox_id)
+        if result == "sent" and message.created_at is not None:
+            DELIVERY_SECONDS.observe(time.time() - message.created_at, kind)
+        MESSAGES.inc(kind, result)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            queue = self.chats[chat_id]
+            message = queue.popleft()
+            try:
+                await self._deliver(message)
+            except Exception as e:
+                # Для строки из outbox аренда истечёт, и сообщение заберёт опрос.
+                self.logger.error("Ошибка доставки сообщения для чата %s: %s", chat_id, e)
+            finally:
+                self.pending -= 1
+                if queue:
+                    self.ready.put_nowait(chat_id)
+                else:
+                    del self.chats[chat_id]
+                if not self.pending:
+                    self.idle.set()
+
+    async def _flush(self):
+        if not self.completed:
+            return
+        completed, self.completed = self.completed, []
+        try:
+            await self.repo.complete_outbox(completed)
+        except Exception:
+            self.completed.extend(completed)
+            raise
+
+    async def _renew(self):
+        # Очередь может разбираться дольше аренды (flood wait, тысячи уведомлений):
+        # продлеваем аренду ожидающих строк, чтобы опрос не отправил их второй раз.
+        now = time.monotonic()
+        stale = [outbox_id for outbox_id, renewed in self.leased.items() if now - renewed > self.lease / 2]
+        if stale:
+            await self.repo.renew_outbox(stale, self.lease)
+            for outbox_id in stale:
+                if outbox_id in self.leased:
+                    self.leased[outbox_id] = now
+
+    async def _claim(self) -> int:
+        claimed = 0
+        while True:
+            room = min(self.batch_size, self.queue_size - self.pending)
+            if room <= 0:
+                break
+            messages = await self.repo.claim_outbox(room, self.lease)
+            for message in messages:
+                self._push(message)
+            claimed += len(messages)
+            if len(messages) < room:
+                break
+        if claimed:
+            self.logger.info("Из outbox взято на отправку сообщений: %s", claimed)
+        return claimed
+
+    async def run(self):
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            while True:
+                self.wakeup.clear()
+                try:
+                    await self._flush()
+                    await self._renew()
+                    await self._claim()
+                except Exception as e:
+                    self.logger.error("Ошибка обработки outbox: %s", e)
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def close(self, timeout: float = 10.0):
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            # Важные сообщения останутся в outbox и уйдут после перезапуска, когда истечёт аренда.
+            self.logger.error("Не доставлено исходящих сообщений при остановке: %s", self.pending)
+        try:
+            await self._flush()
+        except Exception as e:
+            self.logger.error("Не удалось отметить доставленные сообщения: %s", e)
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, tokens: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        # Токены уходят в минус: каждый следующий вызов получает своё место в очереди,
+        # поэтому одновременные ожидающие обслуживаются по порядку без повторных проверок.
+        self._refill()
+        self.tokens -= tokens
+        return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self, tokens: float = 1.0):
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class KeyedTokenBuckets:
+    def __init__(self, rate: float, capacity: float = None, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def get(self, key) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                # Вытесняем самый давний ключ; если его ведро уже полное, состояние не теряется.
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def try_consume(self, key, tokens: float = 1.0) -> bool:
+        return self.get(key).try_consume(tokens)
+
+    async def acquire(self, key, tokens: float = 1.0):
+        await self.get(key).acquire(tokens)
+
+    def __len__(self) -> int:
+        return len(self.buckets)
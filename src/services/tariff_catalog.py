@@ -0,0 +1,65 @@
+import json
+from models.tariff import Tariff
+from logger.logger import Logger
+
+class TariffCatalog:
+    PAYLOAD_PREFIX = "user_"
+
+    def __init__(self, path: str, logger: Logger):
+        self.path = path
+        self.logger = logger
+        self.by_id: dict[tuple[str, str], Tariff] = {}
+        self.by_price: dict[tuple[str, int], Tariff] = {}
+        self.by_type: dict[str, list[Tariff]] = {}
+        self.load()
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            raw = json.load(f)
+        by_id, by_price, by_type = {}, {}, {}
+        for subscription_type, items in raw.items():
+            by_type[subscription_type] = []
+            for tariff_id, item in items.items():
+                tariff = Tariff(tariff_id, subscription_type, int(item["days"]), item["price"], item["name"])
+                if (subscription_type, tariff.price_cents) in by_price:
+                    raise ValueError(f"Два тарифа {subscription_type} с одинаковой ценой {tariff.price}")
+                by_id[(subscription_type, tariff_id)] = tariff
+                by_price[(subscription_type, tariff.price_cents)] = tariff
+                by_type[subscription_type].append(tariff)
+        # Индексы подменяются целиком, так что читатели видят либо старый каталог, либо новый.
+        self.by_id, self.by_price, self.by_type = by_id, by_price, by_type
+        self.logger.info("Загружено тарифов: %s из %s", len(by_id), self.path)
+
+    def reload(self) -> bool:
+        try:
+            self.load()
+            return True
+        except Exception as e:
+            self.logger.error("Не удалось перезагрузить тарифы, остаётся прежний каталог: %s", e)
+            return False
+
+    @property
+    def subscription_types(self) -> list[str]:
+        return list(self.by_type)
+
+    def get(self, subscription_type: str, tariff_id: str) -> Tariff:
+        return self.by_id.get((subscription_type, tariff_id))
+
+    def find_by_amount(self, subscription_type: str, amount) -> Tariff:
+        return self.by_price.get((subscription_type, round(float(amount) * 100)))
+
+    def items(self, subscription_type: str) -> list[Tariff]:
+        return self.by_type.get(subscription_type, [])
+
+    def encode_payload(self, user_id: int, tariff: Tariff) -> str:
+        return f"{self.PAYLOAD_PREFIX}{user_id}:{tariff.subscription_type}:{tariff.tariff_id}"
+
+    def decode_payload(self, payload: str) -> tuple[int, str, str]:
+        # Старые инвойсы несут только user_{id}: тип и тариф для них вернутся как None.
+        if not payload or not payload.startswith(self.PAYLOAD_PREFIX):
+            raise ValueError(f"Неизвестный payload инвойса: {payload}")
+        parts = payload[len(self.PAYLOAD_PREFIX):].split(":")
+        user_id = int(parts[0])
+        if len(parts) == 3:
+            return user_id, parts[1], parts[2]
+        return user_id, None, None
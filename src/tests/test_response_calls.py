@@ -0,0 +1,202 @@
+"""Сколько вызовов Bot API стоит одно обновление: обновления проходят через Handler.dp
+(middleware, обработчики, BotService, ResponseRenderer, Outbox, Notifier) без сети и базы —
+Bot API заменён StubSession, Crypto Pay — StubCryptoService, Repository — словарями в памяти.
+
+Запуск из каталога src:
+
+    python -m pytest -q tests
+"""
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from aiogram import Bot
+from aiogram.types import Update
+from handlers.bot import Handler
+from logger.logger import Logger
+from models.outbox_message import OutboxMessage
+from models.user import User
+from repositories.fsm_storage import ExpiringMemoryStorage
+from repositories.username_buffer import UsernameBuffer
+from services.bot_service import BotService
+from services.expiry_scheduler import ExpiryScheduler
+from services.notifier import Notifier
+from services.outbox import Outbox
+from services.tariff_catalog import TariffCatalog
+from config.config import Config
+from tools.fake_telegram import callback_update, message_update
+from tools.stubs import StubCryptoService, StubSession
+
+USER_ID = 1001
+EDIT = {"editMessageText": 1, "answerCallbackQuery": 1}
+ANSWER = {"answerCallbackQuery": 1}
+
+
+class MemoryRepository:
+    # Ровно то, что нужно обработчикам и Outbox; строки outbox — как в таблице, с арендой.
+    def __init__(self):
+        self.users: dict[int, User] = {}
+        self.payments = {}
+        self.outbox: dict[int, dict] = {}
+        self.next_outbox_id = 1
+
+    def cache_username(self, user_id: int, username: str):
+        pass
+
+    async def get_user(self, user_id: int) -> User:
+        return self.users.get(user_id)
+
+    async def touch_user(self, user_id: int, username: str) -> User:
+        user = self.users.setdefault(user_id, User(user_id))
+        user.username = username
+        return user
+
+    async def set_exchange(self, user: User, exchange: str, api_key: str) -> User:
+        user = self.users.setdefault(user.user_id, user)
+        user.exchange, user.api_key = exchange, api_key
+        return user
+
+    async def get_open_payment(self, idempotency_key: str):
+        return next((payment for payment in self.payments.values()
+                     if payment.idempotency_key == idempotency_key and payment.status == "created"), None)
+
+    async def release_idempotency_key(self, invoice_id: int):
+        self.payments[invoice_id].idempotency_key = None
+
+    async def save_payment(self, payment):
+        self.payments[payment.invoice_id] = payment
+        return payment
+
+    async def get_last_payment(self, user_id: int):
+        payments = [payment for payment in self.payments.values() if payment.user_id == user_id]
+        return max(payments, key=lambda payment: payment.invoice_id, default=None)
+
+    async def apply_payment(self, invoice_id: int, user_id: int, days: int, subscription_type: str, notice=None):
+        payment = self.payments.get(invoice_id)
+        if payment is None or payment.status == "paid":
+            return None
+        payment.status = "paid"
+        user = self.users.setdefault(user_id, User(user_id))
+        user.subscription_end = datetime.now() + timedelta(days=days)
+        user.subscription_type = subscription_type
+        if notice is not None:
+            message = notice(user)
+            self.outbox[self.next_outbox_id] = {"message": message, "status": "pending", "attempts": 0, "next": 0.0}
+            self.next_outbox_id += 1
+        return user
+
+    async def claim_outbox(self, limit: int, lease: float) -> list[OutboxMessage]:
+        claimed = []
+        for outbox_id, row in sorted(self.outbox.items()):
+            if len(claimed) == limit:
+                break
+            if row["status"] == "pending" and row["next"] <= time.monotonic():
+                row["attempts"] += 1
+                row["next"] = time.monotonic() + lease
+                message = row["message"]
+                claimed.append(OutboxMessage(message.chat_id, message.text, message.options, True,
+                                             outbox_id, row["attempts"], time.time()))
+        return claimed
+
+    async def renew_outbox(self, outbox_ids: list[int], lease: float) -> int:
+        for outbox_id in outbox_ids:
+            self.outbox[outbox_id]["next"] = time.monotonic() + lease
+        return len(outbox_ids)
+
+    async def complete_outbox(self, outbox_ids: list[int]) -> int:
+        for outbox_id in outbox_ids:
+            self.outbox.pop(outbox_id, None)
+        return len(outbox_ids)
+
+    async def retry_outbox(self, outbox_id: int, delay: float):
+        self.outbox[outbox_id]["next"] = time.monotonic() + delay
+
+    async def fail_outbox(self, outbox_id: int):
+        self.outbox[outbox_id]["status"] = "failed"
+
+
+class FailingCryptoService(StubCryptoService):
+    async def check_invoice(self, invoice_id: int) -> dict:
+        await self._wait("check_invoice")
+        return {"ok": False, "error": {"code": 500, "name": "INTERNAL_ERROR"}}
+
+
+class Harness:
+    def __init__(self, crypto_service: StubCryptoService):
+        logger = Logger()
+        self.session = StubSession()
+        self.bot = Bot("42:FAKE", session=self.session)
+        self.repo = MemoryRepository()
+        self.repo.users[USER_ID] = User(USER_ID, username=f"user{USER_ID}", subscription_type="regular")
+        self.crypto_service = crypto_service
+        notifier = Notifier(self.bot, logger, global_rate=1000.0, per_chat_rate=1000.0, per_chat_burst=10.0)
+        self.outbox = Outbox(self.repo, notifier, logger, poll_interval=60.0)
+        bot_service = BotService(self.repo, crypto_service, TariffCatalog(Config().tariffs_path, logger), logger,
+                                 ExpiryScheduler(self.repo, logger), self.outbox)
+        self.handler = Handler(self.bot, bot_service, logger, UsernameBuffer(self.repo, logger),
+                               ExpiringMemoryStorage(logger))
+
+    async def feed(self, raw: dict) -> Counter:
+        # Вызовы Bot API, сделанные ради одного обновления, включая доставку через outbox.
+        before = Counter(self.session.calls)
+        update = Update.model_validate(dict(raw, update_id=1), context={"bot": self.bot})
+        await self.handler.dp.feed_update(self.bot, update)
+        await self.outbox._claim()
+        await self.outbox.idle.wait()
+        await self.outbox._flush()
+        return self.session.calls - before
+
+
+def run(crypto_service: StubCryptoService, *steps: tuple[dict, dict]):
+    async def scenario():
+        harness = Harness(crypto_service)
+        task = asyncio.create_task(harness.outbox.run())
+        try:
+            for raw, expected in steps:
+                assert await harness.feed(raw) == Counter(expected), raw
+            assert not harness.repo.outbox
+        finally:
+            task.cancel()
+    asyncio.run(scenario())
+
+
+def test_support_is_one_edit():
+    run(StubCryptoService(), (callback_update(USER_ID, "support"), EDIT))
+
+
+def test_tariff_turns_menu_into_invoice():
+    run(StubCryptoService(), (callback_update(USER_ID, "tariff:1month"), EDIT))
+
+
+def test_check_payment_not_paid_is_notice_only():
+    run(
+        StubCryptoService(status="active"),
+        (callback_update(USER_ID, "tariff:1month"), EDIT),
+        (callback_update(USER_ID, "check_payment:1month"), ANSWER)
+    )
+
+
+def test_check_payment_error_is_notice_only():
+    run(
+        FailingCryptoService(),
+        (callback_update(USER_ID, "tariff:1month"), EDIT),
+        (callback_update(USER_ID, "check_payment:1month"), ANSWER)
+    )
+
+
+def test_check_payment_paid_edits_once_from_outbox():
+    run(
+        StubCryptoService(status="paid"),
+        (callback_update(USER_ID, "tariff:1month"), EDIT),
+        (callback_update(USER_ID, "check_payment:1month"), EDIT),
+        # Повторное нажатие: оплата уже применена, профиль показывается той же правкой.
+        (callback_update(USER_ID, "check_payment:1month"), EDIT)
+    )
+
+
+def test_api_key_is_one_message():
+    run(
+        StubCryptoService(),
+        (callback_update(USER_ID, "exchange:Bybit"), EDIT),
+        (message_update(USER_ID, "api-key"), {"sendMessage": 1})
+    )
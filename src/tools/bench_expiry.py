@@ -0,0 +1,71 @@
+"""Замер пропускной способности истечения подписок: пакетный DELETE ... RETURNING
+плюс рассылка уведомлений через Outbox и Notifier с заглушкой вместо Bot.
+
+Запуск из каталога src (нужна база с таблицей users, параметры берутся из DB_*):
+
+    python -m tools.bench_expiry --users 10000 --latency 0.03 --global-rate 30
+"""
+import argparse
+import asyncio
+import time
+from config.config import Config
+from logger.logger import Logger
+from repositories.db import Repository
+from services.bot_service import BotService
+from services.notifier import Notifier
+from services.outbox import Outbox
+from services.tariff_catalog import TariffCatalog
+from tools.stubs import StubBot
+
+FIRST_USER_ID = 10 ** 12
+
+
+async def run(args):
+    config = Config()
+    logger = Logger()
+    repo = Repository(config.db_config, logger, **config.db_pool_config)
+    await repo._execute(
+        """
+        INSERT INTO users (user_id, subscription_end, username, is_referral, subscription_type)
+        SELECT id, now() - interval '1 day', 'bench_' || id, FALSE, 'regular'
+        FROM generate_series(%s::bigint, %s::bigint) AS id
+        ON CONFLICT (user_id) DO UPDATE SET subscription_end = EXCLUDED.subscription_end
+        """,
+        (FIRST_USER_ID, FIRST_USER_ID + args.users - 1)
+    )
+    bot = StubBot(latency=args.latency, retry_after_rate=args.retry_after_rate)
+    notifier = Notifier(bot, logger, global_rate=args.global_rate, per_chat_rate=1.0)
+    outbox = Outbox(repo, notifier, logger, workers=args.concurrency, queue_size=args.users)
+    bot_service = BotService(repo, None, TariffCatalog(config.tariffs_path, logger), logger, None, outbox)
+    BotService.EXPIRE_BATCH_SIZE = args.batch_size
+    outbox_task = asyncio.create_task(outbox.run())
+
+    started = time.perf_counter()
+    expired = await bot_service.expire_subscriptions()
+    queued = time.perf_counter() - started
+    # Уведомления лежат в таблице outbox: забираем их все и ждём доставки.
+    while await outbox._claim():
+        await outbox.idle.wait()
+    await outbox.close(timeout=None)
+    elapsed = time.perf_counter() - started
+    outbox_task.cancel()
+    print(
+        f"expired={expired} queued in {queued:.2f}s sent={bot.calls['send_message']} elapsed={elapsed:.2f}s "
+        f"throughput={expired / elapsed:.0f} users/s"
+    )
+    await repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк истечения подписок")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.03, help="Задержка send_message заглушки, с")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0)
+    parser.add_argument("--global-rate", type=float, default=30.0, help="Лимит сообщений в секунду")
+    parser.add_argument("--concurrency", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Сравнение хранилищ FSM на сценарии ввода API-ключа: выбор тарифа, биржи,
+ввод ключа и сброс состояния — те же вызовы, что делают обработчики бота.
+
+Запуск из каталога src (для postgres нужны DB_*, для redis — пакет redis):
+
+    python -m tools.bench_fsm_storage --storages memory postgres --users 2000 --concurrency 200
+    python -m tools.bench_fsm_storage --storages expiring --users 100000 --ttl 1
+    python -m tools.bench_fsm_storage --storages redis --redis-url redis://127.0.0.1:6379/0
+"""
+import argparse
+import asyncio
+import logging
+import time
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from config.config import Config
+from logger.logger import Logger
+from repositories.db import Repository
+from repositories.migrator import Migrator
+from repositories.fsm_storage import ExpiringMemoryStorage, PostgresStorage
+from tools.stats import summarize, format_summary
+
+BOT_ID = 42
+FIRST_USER_ID = 10 ** 12
+
+
+async def flow(storage, user_id: int):
+    key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+    await storage.get_state(key)
+    await storage.set_state(key, "PaymentStates:waiting_for_payment")
+    await storage.update_data(key, {"exchange": "bybit"})
+    await storage.set_state(key, "PaymentStates:waiting_for_api_key")
+    await storage.get_state(key)
+    data = await storage.get_data(key)
+    assert data.get("exchange") == "bybit", data
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+
+
+async def run_flows(storage, users: int, concurrency: int) -> dict:
+    latencies = []
+    queue = asyncio.Queue()
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users):
+        queue.put_nowait(user_id)
+
+    async def worker():
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            started = time.perf_counter()
+            await flow(storage, user_id)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def run_batch(storage, users: int) -> tuple[float, float]:
+    keys = [StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+            for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users)]
+    started = time.perf_counter()
+    await storage.set_many({key: ("PaymentStates:waiting_for_payment", {"exchange": "bybit"}) for key in keys})
+    records = await storage.get_many(keys)
+    batched = time.perf_counter() - started
+    assert all(state for state, _ in records.values())
+    await storage.set_many({key: (None, {}) for key in keys})
+
+    started = time.perf_counter()
+    for key in keys:
+        await storage.set_state(key, "PaymentStates:waiting_for_payment")
+    for key in keys:
+        await storage.get_state(key)
+    sequential = time.perf_counter() - started
+    await storage.set_many({key: (None, {}) for key in keys})
+    return batched, sequential
+
+
+async def run_abandoned(storage: ExpiringMemoryStorage, users: int, ttl: float):
+    # Пользователи выбрали биржу и ушли: состояние остаётся, пока его не уберёт сборщик.
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users):
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        await storage.update_data(key, {"exchange": "bybit"})
+        await storage.set_state(key, "PaymentStates:waiting_for_api_key")
+    print(f"expiring after {users} abandoned flows: {storage.metrics}")
+    await asyncio.sleep(ttl)
+    started = time.perf_counter()
+    evicted = storage.sweep(storage.SWEEP_CHUNK)
+    chunk = time.perf_counter() - started
+    evicted += storage.sweep()
+    print(f"expiring sweep evicted={evicted}, {storage.SWEEP_CHUNK}-record chunk took {chunk * 1000:.1f}ms: {storage.metrics}")
+
+
+async def create_storage(name: str, args, logger: Logger):
+    if name == "memory":
+        return MemoryStorage(), None
+    if name == "expiring":
+        return ExpiringMemoryStorage(logger, default_ttl=args.ttl), None
+    if name == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+        return RedisStorage.from_url(args.redis_url, key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True)), None
+    config = Config()
+    repo = Repository(config.db_config, logger, max_size=args.pool_size)
+    await Migrator(repo, logger).migrate()
+    return PostgresStorage(repo, logger), repo
+
+
+async def run(args):
+    logger = Logger()
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in args.storages:
+        storage, repo = await create_storage(name, args, logger)
+        result = await run_flows(storage, args.users, args.concurrency)
+        print(format_summary(f"{name} flow (9 ops)", result))
+        if isinstance(storage, ExpiringMemoryStorage):
+            await run_abandoned(storage, args.users, args.ttl)
+        if isinstance(storage, PostgresStorage):
+            stats = storage.stats
+            print(f"{name} reads={stats['reads']} read batches={stats['batches']} writes={stats['writes']}")
+            batched, sequential = await run_batch(storage, args.batch)
+            print(f"{name} {args.batch} keys: set_many+get_many {batched * 1000:.1f}ms, "
+                  f"per-key set+get {sequential * 1000:.1f}ms")
+        await storage.close()
+        if repo is not None:
+            await repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилищ FSM")
+    parser.add_argument("--storages", nargs="+", default=["memory", "postgres"], choices=["memory", "expiring", "postgres", "redis"])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=1000, help="Размер пакета для set_many/get_many")
+    parser.add_argument("--ttl", type=float, default=1.0, help="TTL состояний для expiring, с")
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/0")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
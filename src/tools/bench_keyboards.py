@@ -0,0 +1,112 @@
+"""Микробенчмарк клавиатур на пути навигации по меню: /start, «Продлить подписку»,
+«Главное меню», «Поддержка». Сравнивает сборку разметки на каждый вызов (как было
+раньше) с общими экземплярами из KeyboardRegistry — время и память на обновление.
+
+Запуск из каталога src:
+
+    python -m tools.bench_keyboards --iterations 20000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from aiogram import types
+from config.config import Config
+from keyboards.keyboards import KeyboardRegistry
+from logger.logger import Logger
+from models.user import User
+from services.bot_service import BotService
+from services.tariff_catalog import TariffCatalog
+
+with open(Config().tariffs_path, encoding="utf-8") as f:
+    TARIFFS = json.load(f)
+
+USERS = [
+    User(user_id=1, subscription_type="regular", exchange="Binance"),
+    User(user_id=2, subscription_type="referral"),
+    User(user_id=3)
+]
+
+
+def legacy_profile(user: User) -> types.InlineKeyboardMarkup:
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [
+            types.InlineKeyboardButton(text="📞 Поддержка", callback_data="support"),
+            types.InlineKeyboardButton(text="💳 Продлить подписку", callback_data="extend_subscription")
+        ]
+    ])
+    if user and user.subscription_type and not user.exchange:
+        keyboard.inline_keyboard.append([
+            types.InlineKeyboardButton(text=f"{exchange}", callback_data=f"exchange:{exchange}")
+            for exchange in BotService.SUPPORTED_EXCHANGES
+        ])
+    return keyboard
+
+
+def legacy_tariffs(user: User) -> types.InlineKeyboardMarkup:
+    subscription_type = user.subscription_type if user and user.subscription_type else "regular"
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=f"{tariff['name']} - {tariff['price']}$", callback_data=f"tariff:{tariff_id}")]
+        for tariff_id, tariff in TARIFFS[subscription_type].items()
+    ])
+    keyboard.inline_keyboard.append([
+        types.InlineKeyboardButton(text="📞 Поддержка", callback_data="support"),
+        types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")
+    ])
+    return keyboard
+
+
+def legacy_main_menu() -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
+    ])
+
+
+def legacy_navigation(user: User) -> list:
+    return [legacy_profile(user), legacy_tariffs(user), legacy_profile(user), legacy_main_menu()]
+
+
+def registry_navigation(registry: KeyboardRegistry, user: User) -> list:
+    return [registry.profile(user), registry.tariffs(user), registry.profile(user), registry.main_menu]
+
+
+def measure(name: str, navigate, iterations: int):
+    started = time.perf_counter()
+    for index in range(iterations):
+        navigate(USERS[index % len(USERS)])
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [navigate(USERS[index % len(USERS)]) for index in range(1000)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename") if stat.size_diff > 0)
+    del kept
+    per_update_us = elapsed / iterations / 4 * 1e6
+    print(f"{name:10s} {per_update_us:8.2f} us/update  {allocated / 4000:8.0f} B/update retained")
+    return per_update_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк клавиатур")
+    parser.add_argument("--iterations", type=int, default=20000, help="Проходов по 4 экрана меню")
+    args = parser.parse_args()
+    registry = KeyboardRegistry(TariffCatalog(Config().tariffs_path, Logger()), BotService.SUPPORTED_EXCHANGES)
+    for user in USERS:
+        assert registry.profile(user) == legacy_profile(user)
+        assert registry.tariffs(user) == legacy_tariffs(user)
+    assert registry.main_menu == legacy_main_menu()
+
+    legacy = measure("legacy", legacy_navigation, args.iterations)
+    shared = measure("registry", lambda user: registry_navigation(registry, user), args.iterations)
+    # Для сравнения: сериализация разметки в запрос к Bot API остаётся на каждом вызове.
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        registry.tariffs(USERS[0]).model_dump(exclude_none=True)
+    dump_us = (time.perf_counter() - started) / args.iterations * 1e6
+    print(f"saved {legacy - shared:.2f} us/update; serializing one tariff menu costs {dump_us:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Стоимость логирования на event loop: прежний синхронный StreamHandler с
+f-строками против очереди Logger с отложенной подстановкой аргументов.
+
+Вывод идёт в /dev/null. Для очереди отдельно измеряется цена вызова (поток
+записи остановлен, записи копятся) и время, за которое поток записи их
+разбирает. Запуск из каталога src:
+
+    python -m tools.bench_logging --lines 100000
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+from logger.logger import Logger
+from models.user import User
+
+
+def measure(name: str, write, lines: int):
+    started = time.perf_counter()
+    for index in range(lines):
+        write(index)
+    elapsed = time.perf_counter() - started
+    print(f"{name:40s} {elapsed / lines * 1e6:.2f} us/line")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк логирования")
+    parser.add_argument("--lines", type=int, default=100000)
+    args = parser.parse_args()
+    user = User(1, datetime.now(), "Bybit", "key", "user", False, "regular")
+
+    devnull = open(os.devnull, "w")
+    sync = logging.getLogger("bench.sync")
+    sync.propagate = False
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter(Logger.FORMAT))
+    sync.addHandler(handler)
+    sync.setLevel(logging.INFO)
+    measure("sync StreamHandler, f-string", lambda i: sync.info(
+        f"Сохранение пользователя: user_id={user.user_id}, subscription_end={user.subscription_end}, "
+        f"exchange={user.exchange}, api_key={user.api_key}, username={user.username}"
+    ), args.lines)
+
+    logger = Logger()
+    Logger.listener.handlers[0].setStream(devnull)
+    Logger.shutdown()
+    measure("Logger queue, lazy args (caller)", lambda i: logger.info(
+        "Сохранение пользователя: user_id=%s, subscription_end=%s, exchange=%s",
+        user.user_id, user.subscription_end, user.exchange
+    ), args.lines)
+    started = time.perf_counter()
+    Logger.listener.start()
+    Logger.shutdown()
+    print(f"{'Logger queue (writer thread)':40s} {(time.perf_counter() - started) / args.lines * 1e6:.2f} us/line")
+    logging.getLogger().setLevel(logging.INFO)
+    measure("Logger, debug line below level", lambda i: logger.debug(
+        "Получение пользователя с ID %s", user.user_id
+    ), args.lines)
+    logger.sample_rate = 0.1
+    measure("Logger, sampled at 0.1", lambda i: logger.sample(
+        "Проверка оплаты для user_id: %s, tariff_id: %s", user.user_id, "1month"
+    ), args.lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Бенчмарк операций Repository и BotService на заполненной локальной базе.
+
+Заполняет базу (по умолчанию 100k пользователей и 1M платежей), прогоняет каждую
+операцию с заглушками вместо Bot и CryptoService и печатает пропускную способность и
+p50/p95/p99. Результат сохраняется в JSON с хэшем коммита; --compare сравнивает с
+предыдущим прогоном. Засеянные строки удаляются в конце (кроме --keep-data).
+
+Сценарии check_payment проверяют ответ: вызов, ушедший в ветку ошибки, считается
+неудачным, и при хотя бы одной неудаче прогон завершается с ненулевым кодом —
+иначе в цифры попадало бы время обработки ошибок, а не самой операции.
+Запускать на отдельной базе: save_user/touch_user пишут в users.
+
+Запуск из каталога src:
+
+    python -m tools.bench_repository --iterations 2000 --concurrency 8
+    python -m tools.bench_repository --compare bench_results/repository_<commit>.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta
+from config.config import Config
+from logger.logger import Logger
+from models.user import User
+from repositories.db import Repository
+from repositories.migrator import Migrator
+from repositories.user_cache import UserCache
+from services.bot_service import BotService
+from services.expiry_scheduler import ExpiryScheduler
+from services.tariff_catalog import TariffCatalog
+from tools.seed import SEED_BASE, SEED_PRICES, SEED_TARIFF, seed, seeded_payment, last_invoice_id, cleanup
+from tools.stats import summarize, format_summary
+from tools.stubs import StubCryptoService, StubOutbox
+
+
+def git_revision() -> tuple[str, bool]:
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True).strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+async def measure(operation, iterations: int, concurrency: int) -> dict:
+    latencies = []
+    errors = []
+    counter = iter(range(iterations))
+
+    async def worker():
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                await operation(index)
+            except Exception as e:
+                errors.append(e)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    summary = summarize(latencies, time.perf_counter() - started)
+    summary["errors"] = len(errors)
+    if errors:
+        summary["first_error"] = repr(errors[0])
+    return summary
+
+
+def operations(args, repo: Repository, cached_repo: Repository, tariffs: TariffCatalog, logger: Logger) -> dict:
+    def user_id() -> int:
+        return SEED_BASE + random.randint(1, args.users)
+
+    hot_users = [SEED_BASE + i for i in range(1, 101)]
+    now = datetime.now()
+    # Последний платеж пользователя решает, по какой ветке пойдёт check_payment: для «уже
+    # оплачено» берутся только пользователи с оплаченным последним платежом, иначе замер
+    # применял бы засеянные платежи и менял данные.
+    last_status = {}
+    for index in range(1, args.users + 1):
+        invoice_id = last_invoice_id(SEED_BASE + index, args.users, args.payments)
+        if invoice_id is not None:
+            last_status[SEED_BASE + index] = seeded_payment(invoice_id, args.users)[2]
+    with_payments = list(last_status)
+    paid_users = [user_id for user_id, status in last_status.items() if status == "paid"]
+
+    def invoice_fields(invoice_id: int) -> dict:
+        # Сумма и payload, какие Crypto Pay вернул бы для засеянного платежа.
+        payer, subscription_type, _ = seeded_payment(invoice_id, args.users)
+        tariff = tariffs.get(subscription_type, SEED_TARIFF)
+        return {"amount": str(tariff.price), "payload": tariffs.encode_payload(payer, tariff)}
+
+    def service(status: str) -> BotService:
+        crypto_service = StubCryptoService(args.stub_latency, status, invoice_fields)
+        return BotService(repo, crypto_service, tariffs, logger, ExpiryScheduler(repo, logger), StubOutbox())
+
+    pending = service("active")
+    paid = service("paid")
+
+    async def check_payment(bot_service: BotService, users: list[int], expected: str):
+        user = await repo.get_user(random.choice(users))
+        response = await bot_service.check_payment(user)
+        outcome = response.notice if response.notice is not None else response.text
+        if not (outcome or "").startswith(expected):
+            raise RuntimeError(f"check_payment для {user.user_id}: {outcome!r}")
+
+    return {
+        "get_user": lambda i: repo.get_user(user_id()),
+        "get_user (cache hit)": lambda i: cached_repo.get_user(hot_users[i % len(hot_users)]),
+        "touch_user": lambda i: repo.touch_user(user_id(), f"seed_{i}"),
+        "save_user": lambda i: repo.save_user(User(
+            user_id(), now + timedelta(days=30), "Bybit", "key", f"seed_{i}", False, "regular"
+        )),
+        "get_expired_users": lambda i: repo.get_expired_users(),
+        "get_next_subscription_end": lambda i: repo.get_next_subscription_end(),
+        "get_last_payment": lambda i: repo.get_last_payment(user_id()),
+        "get_payments_by_user": lambda i: repo.get_payments_by_user(user_id()),
+        "get_pending_payments": lambda i: repo.get_pending_payments(SEED_BASE + random.randint(0, args.payments), 100),
+        "check_payment (not paid)": lambda i: check_payment(pending, with_payments, "Платеж еще не подтвержден"),
+        "check_payment (already paid)": lambda i: check_payment(paid, paid_users, "✅ Оплата уже подтверждена")
+    }
+
+
+def compare(results: dict, path: str):
+    with open(path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\ncompared with {baseline['commit']} ({path}):")
+    for name, summary in results.items():
+        before = baseline["results"].get(name)
+        if not before:
+            continue
+        deltas = []
+        for key in ("p50_ms", "p99_ms", "throughput"):
+            if before.get(key):
+                deltas.append(f"{key} {(summary[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"{name:32s} {' '.join(deltas)}")
+
+
+async def run(args):
+    config = Config()
+    logger = Logger()
+    logging.getLogger().setLevel(logging.WARNING)
+    repo = Repository(config.db_config, logger, max_size=args.pool_size, statement_timeout=0)
+    cached_repo = Repository(config.db_config, logger, max_size=args.pool_size, user_cache=UserCache())
+    tariffs = TariffCatalog(config.tariffs_path, logger)
+    for subscription_type, price in SEED_PRICES.items():
+        tariff = tariffs.get(subscription_type, SEED_TARIFF)
+        if tariff is None or tariff.price != price:
+            raise SystemExit(f"Тариф {subscription_type}/{SEED_TARIFF} не совпадает с ценой засеянных платежей {price}")
+    await Migrator(repo, logger).migrate()
+
+    def prepare(cursor):
+        cleanup(cursor)
+        seed(cursor, args.users, args.payments, 0)
+
+    started = time.perf_counter()
+    await repo._run(prepare)
+    print(f"seeded {args.users} users and {args.payments} payments in {time.perf_counter() - started:.1f}s")
+
+    results = {}
+    try:
+        for name, operation in operations(args, repo, cached_repo, tariffs, logger).items():
+            if args.only and name not in args.only:
+                continue
+            await measure(operation, min(args.warmup, args.iterations), args.concurrency)
+            results[name] = await measure(operation, args.iterations, args.concurrency)
+            print(f"{format_summary(name, results[name])} errors={results[name]['errors']}")
+            if results[name]["errors"]:
+                print(f"{'':32s} first error: {results[name]['first_error']}")
+    finally:
+        if not args.keep_data:
+            await repo._run(cleanup)
+        await cached_repo.close()
+        await repo.close()
+
+    sha, dirty = git_revision()
+    output = args.output or os.path.join("bench_results", f"repository_{sha}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": sha,
+            "dirty": dirty,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "params": vars(args),
+            "results": results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+    failed = {name: summary["errors"] for name, summary in results.items() if summary["errors"]}
+    if failed:
+        raise SystemExit(f"Операции с ошибками: {failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк Repository и BotService")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--payments", type=int, default=1000000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Задержка заглушек Bot и CryptoService, с")
+    parser.add_argument("--only", nargs="+", help="Запустить только указанные операции")
+    parser.add_argument("--output", help="Куда записать JSON (по умолчанию bench_results/repository_<commit>.json)")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--keep-data", action="store_true", help="Не удалять засеянные строки")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Защита от спама кнопкой «Проверить оплату»: обычные пользователи и
+несколько скриптов, нажимающих check_payment без остановки.
+
+Обработчик имитирует check_payment: работа занимает --work секунд и идёт
+через общий ресурс ёмкостью --capacity (как пул базы и семафор CryptoService).
+Сравниваются прогоны без ThrottlingMiddleware и с ним: сколько нажатий дошло до
+ресурса и какую задержку видят обычные пользователи. Bot API — фейковый, в том же
+процессе.
+
+Запуск из каталога src:
+
+    python -m tools.bench_throttling --abusers 20 --abuse-rate 50 --users 200 --duration 10
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from aiohttp import web
+from aiogram import Dispatcher, Router, F, types
+from aiogram.types import Update
+from handlers.middlewares import ThrottlingMiddleware
+from logger.logger import Logger
+from tools.fake_telegram import FakeTelegram, make_bot, callback_update
+from tools.stats import summarize, format_summary
+
+ABUSER_BASE = 1000
+USER_BASE = 100000
+
+
+def build_dispatcher(args, throttling: ThrottlingMiddleware, stats: dict) -> Dispatcher:
+    backend = asyncio.Semaphore(args.capacity)
+    router = Router()
+
+    @router.callback_query(F.data.startswith("check_payment:"))
+    async def check_payment(callback_query: types.CallbackQuery):
+        async with backend:
+            stats["backend_calls"] += 1
+            await asyncio.sleep(args.work)
+        await callback_query.answer()
+
+    dp = Dispatcher()
+    if throttling is not None:
+        dp.callback_query.outer_middleware(throttling)
+    dp.include_router(router)
+    return dp
+
+
+async def bench(args, bot, throttled: bool) -> dict:
+    throttling = ThrottlingMiddleware(
+        args.user_rate, args.user_burst, {"check_payment:": (args.prefix_rate, args.prefix_burst)}
+    ) if throttled else None
+    stats = {"backend_calls": 0}
+    dp = build_dispatcher(args, throttling, stats)
+    latencies = {"user": [], "abuser": []}
+    tasks = set()
+
+    async def feed(kind: str, user_id: int):
+        update = Update.model_validate(
+            dict(callback_update(user_id, "check_payment:1month"), update_id=1), context={"bot": bot}
+        )
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies[kind].append(time.perf_counter() - started)
+
+    def spawn(kind: str, user_id: int):
+        task = asyncio.create_task(feed(kind, user_id))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def abuser(user_id: int):
+        while time.perf_counter() < deadline:
+            spawn("abuser", user_id)
+            await asyncio.sleep(1 / args.abuse_rate)
+
+    async def user(user_id: int):
+        await asyncio.sleep(random.uniform(0, args.user_interval))
+        while time.perf_counter() < deadline:
+            spawn("user", user_id)
+            await asyncio.sleep(args.user_interval)
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(
+        *(abuser(ABUSER_BASE + index) for index in range(args.abusers)),
+        *(user(USER_BASE + index) for index in range(args.users))
+    )
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    return {
+        "user": summarize(latencies["user"], elapsed),
+        "abuser": summarize(latencies["abuser"], elapsed),
+        "backend_calls": stats["backend_calls"]
+    }
+
+
+async def run(args):
+    Logger()
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = FakeTelegram()
+    runner = web.AppRunner(fake.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    bot = make_bot(f"http://127.0.0.1:{args.port}")
+    try:
+        for throttled in (False, True):
+            name = "throttled" if throttled else "unprotected"
+            result = await bench(args, bot, throttled)
+            print(format_summary(f"{name} users", result["user"]))
+            print(format_summary(f"{name} abusers", result["abuser"]))
+            print(f"{name} backend calls: {result['backend_calls']}")
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк ThrottlingMiddleware под спамом")
+    parser.add_argument("--abusers", type=int, default=20)
+    parser.add_argument("--abuse-rate", type=float, default=50.0, help="Нажатий в секунду от каждого скрипта")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--user-interval", type=float, default=5.0, help="Пауза между нажатиями пользователя, с")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--work", type=float, default=0.05, help="Длительность check_payment, с")
+    parser.add_argument("--capacity", type=int, default=10, help="Параллельных check_payment")
+    parser.add_argument("--user-rate", type=float, default=2.0)
+    parser.add_argument("--user-burst", type=float, default=5.0)
+    parser.add_argument("--prefix-rate", type=float, default=0.2)
+    parser.add_argument("--prefix-burst", type=float, default=3.0)
+    parser.add_argument("--port", type=int, default=8099)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
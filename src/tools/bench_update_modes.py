@@ -0,0 +1,191 @@
+"""Сравнение режимов получения обновлений: long polling против вебхука с
+ограниченной очередью.
+
+Фейковый Bot API и генератор обновлений работают в отдельном процессе, чтобы
+не делить event loop с измеряемым ботом. Обработчик имитирует работу задержкой
+и отвечает одним sendMessage. Время прихода обновления передаётся в тексте
+команды, поэтому задержка считается от момента, когда обновление стало
+доступно боту (подложено в getUpdates или отправлено на вебхук).
+
+Запуск из каталога src:
+
+    python -m tools.bench_update_modes --updates 5000 --rate 1000 --work 0.01
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+import aiohttp
+from aiohttp import web
+from aiogram import Dispatcher, Router, types
+from aiogram.filters import Command
+from handlers.telegram_webhook import TelegramWebhook
+from logger.logger import Logger
+from tools.fake_telegram import FakeTelegram, make_bot, message_update
+from tools.stats import summarize, format_summary
+
+SECRET = "bench-secret"
+
+
+async def paced(count: int, rate: float):
+    started = time.perf_counter()
+    for index in range(count):
+        delay = started + index / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield index
+
+
+async def generate(args, mode: str, stop):
+    fake = FakeTelegram(latency=args.api_latency)
+    runner = web.AppRunner(fake.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    await asyncio.sleep(args.warmup)
+
+    if mode == "polling":
+        async for index in paced(args.updates, args.rate):
+            fake.inject(message_update(10_000 + index % args.users, f"/ping {time.time()}"))
+    else:
+        connector = aiohttp.TCPConnector(limit=args.connections)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async def post(update: dict):
+                while True:
+                    async with session.post(
+                        f"http://127.0.0.1:{args.port + 1}/telegram",
+                        json=update,
+                        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+                    ) as response:
+                        if response.status == 200:
+                            return
+                    await asyncio.sleep(0.05)
+
+            posts = []
+            async for index in paced(args.updates, args.rate):
+                update = dict(message_update(10_000 + index % args.users, f"/ping {time.time()}"), update_id=index + 1)
+                posts.append(asyncio.create_task(post(update)))
+            await asyncio.gather(*posts)
+    # Фейковый API живёт, пока бот не обработает всё отправленное.
+    while not stop.is_set():
+        await asyncio.sleep(0.1)
+    await runner.cleanup()
+
+
+def generator_process(args, mode: str, stop):
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(generate(args, mode, stop))
+
+
+class Recorder:
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.handler_latency = []
+        self.end_to_end = []
+        self.errors = 0
+        self.first_arrival = None
+        self.last_done = 0.0
+        self.finished = asyncio.Event()
+
+    def build_dispatcher(self, work: float) -> Dispatcher:
+        router = Router()
+
+        @router.message(Command("ping"))
+        async def ping(message: types.Message):
+            started = time.perf_counter()
+            try:
+                if work:
+                    await asyncio.sleep(work)
+                await message.answer("pong")
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.handler_latency.append(time.perf_counter() - started)
+                arrived = float(message.text.split()[1])
+                self.last_done = time.time()
+                self.first_arrival = min(self.first_arrival or arrived, arrived)
+                self.end_to_end.append(self.last_done - arrived)
+                if len(self.end_to_end) >= self.expected:
+                    self.finished.set()
+
+        dp = Dispatcher()
+        dp.include_router(router)
+        return dp
+
+    def result(self) -> dict:
+        elapsed = self.last_done - self.first_arrival
+        return {
+            "end_to_end": summarize(self.end_to_end, elapsed),
+            "handler": summarize(self.handler_latency),
+            "errors": self.errors
+        }
+
+
+async def bench(args, mode: str) -> dict:
+    recorder = Recorder(args.updates)
+    dp = recorder.build_dispatcher(args.work)
+    bot = make_bot(f"http://127.0.0.1:{args.port}")
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(target=generator_process, args=(args, mode, stop))
+    process.start()
+
+    if mode == "polling":
+        await asyncio.sleep(args.warmup / 2)
+        polling = asyncio.create_task(
+            dp.start_polling(bot, handle_signals=False, close_bot_session=False, polling_timeout=10)
+        )
+        await recorder.finished.wait()
+        await dp.stop_polling()
+        await polling
+    else:
+        webhook = TelegramWebhook(dp, bot, Logger(), SECRET, queue_size=args.queue_size, workers=args.workers)
+        app = web.Application()
+        webhook.register(app, "/telegram")
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", args.port + 1).start()
+        await webhook.start()
+        await recorder.finished.wait()
+        await webhook.stop()
+        await runner.cleanup()
+        recorder.rejected = webhook.stats["rejected"]
+
+    await bot.session.close()
+    stop.set()
+    await asyncio.get_running_loop().run_in_executor(None, process.join)
+    result = recorder.result()
+    result["rejected"] = getattr(recorder, "rejected", 0)
+    return result
+
+
+async def run(args):
+    Logger()
+    logging.getLogger().setLevel(logging.WARNING)
+    for mode in args.modes:
+        result = await bench(args, mode)
+        print(format_summary(f"{mode} end-to-end", result["end_to_end"]))
+        print(format_summary(f"{mode} handler", result["handler"]))
+        print(f"{mode} handler errors: {result['errors']}")
+        if mode == "webhook":
+            print(f"{mode} rejected with 503 and redelivered: {result['rejected']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк polling против webhook")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=1000.0, help="Входящих обновлений в секунду")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--work", type=float, default=0.01, help="Имитация работы обработчика, с")
+    parser.add_argument("--api-latency", type=float, default=0.005, help="Задержка фейкового Bot API, с")
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--connections", type=int, default=100, help="Параллельных соединений Telegram к вебхуку")
+    parser.add_argument("--port", type=int, default=8095)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--modes", nargs="+", default=["polling", "webhook"], choices=["polling", "webhook"])
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
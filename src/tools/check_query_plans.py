@@ -0,0 +1,190 @@
+"""Проверка планов запросов Repository: на заполненной базе (по умолчанию 1M пользователей
+и 1M платежей) каждый запрос к users/payments/fsm_states/outbox должен идти по индексу.
+
+Проверяются сами константы *_SQL из repositories/db.py, а не их копии: для каждой здесь
+задан пример параметров. Ошибкой считаются и константа без примера, и SQL, написанный
+прямо в методе Repository, — так новый запрос не пройдёт мимо проверки.
+
+Данные вставляются, анализируются и проверяются в одной транзакции, которая в конце
+откатывается, так что база остаётся как была. Запускать лучше на отдельной базе.
+Ненулевой код выхода, если хотя бы один план содержит Seq Scan.
+
+Запуск из каталога src:
+
+    python -m tools.check_query_plans --users 1000000 --payments 1000000
+"""
+import argparse
+import ast
+import asyncio
+import json
+import re
+import sys
+import time
+from datetime import datetime
+from psycopg2.extras import Json
+from config.config import Config
+from logger.logger import Logger
+from repositories import db
+from repositories.db import Repository
+from repositories.migrator import Migrator
+from tools.seed import SEED_BASE, seed
+
+TABLES = {"users", "payments", "fsm_states", "outbox"}
+INDEX_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Heap Scan", "Bitmap Index Scan"}
+SQL_LITERAL = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\s", re.IGNORECASE)
+
+
+def statements() -> dict[str, str]:
+    return {name: value for name, value in vars(db).items() if name.endswith("_SQL") and isinstance(value, str)}
+
+
+def inline_sql() -> list[str]:
+    # Строковые литералы с SQL внутри класса Repository: такой запрос не виден проверке.
+    with open(db.__file__, encoding="utf-8") as source:
+        tree = ast.parse(source.read())
+    found = []
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == Repository.__name__:
+            for child in ast.walk(node):
+                if isinstance(child, ast.Constant) and isinstance(child.value, str) and SQL_LITERAL.match(child.value):
+                    found.append(f"{db.__name__}:{child.lineno}")
+    return found
+
+
+def samples(users: int) -> dict[str, tuple]:
+    # Параметры для каждой константы. Для запросов через execute_values (VALUES %s)
+    # задаётся список строк: они подставляются в текст так же, как это делает execute_values.
+    user_id = SEED_BASE + users // 2
+    invoice_id = SEED_BASE + 4242
+    now = datetime.now()
+    fsm_key = "fsm:seed:4242"
+    outbox_ids = [SEED_BASE + i for i in range(100)]
+    return {
+        "INSERT_OUTBOX_SQL": [(user_id, "Ваша подписка истекла.", Json({}))],
+        "GET_USER_SQL": (user_id,),
+        "TOUCH_USER_SQL": (user_id, "name"),
+        "SAVE_USER_SQL": (user_id, now, "Bybit", "key", "name", False, "regular"),
+        "SET_SUBSCRIPTION_TYPE_SQL": (user_id, "name", False, "regular"),
+        "SET_EXCHANGE_SQL": (user_id, "name", "Bybit", "key"),
+        "UPDATE_USERNAMES_SQL": [(SEED_BASE + i, f"renamed_{i}") for i in range(1, 101)],
+        "DELETE_USER_SQL": (user_id,),
+        "GET_EXPIRED_USERS_SQL": (now,),
+        "EXPIRE_USERS_SQL": (now, 1000),
+        "GET_NEXT_SUBSCRIPTION_END_SQL": (),
+        "SAVE_PAYMENT_SQL": (SEED_BASE - 1, user_id, 70, "USDT", "created", "1month", "https://pay", now, "seed:new"),
+        "GET_OPEN_PAYMENT_SQL": ("seed:4200",),
+        "RELEASE_IDEMPOTENCY_KEY_SQL": (invoice_id,),
+        "UPDATE_PAYMENT_STATUS_SQL": ("paid", invoice_id),
+        "UPDATE_PAYMENT_STATUSES_SQL": ("expired", [invoice_id + i for i in range(100)], "created"),
+        "GET_PENDING_PAYMENTS_SQL": (SEED_BASE + 500000, 100),
+        "MARK_PAYMENT_PAID_SQL": (invoice_id,),
+        "EXTEND_SUBSCRIPTION_SQL": (user_id, now, 30, "regular", now, 30),
+        "GET_PAYMENTS_BY_USER_SQL": (user_id,),
+        "GET_LAST_PAYMENT_SQL": (user_id,),
+        "GET_FSM_RECORDS_SQL": ([fsm_key, "fsm:seed:1"],),
+        "DELETE_FSM_RECORDS_SQL": ([fsm_key, "fsm:seed:1"],),
+        "UPSERT_FSM_RECORDS_SQL": [(f"fsm:seed:{i}", "PaymentStates:waiting_for_payment", Json({})) for i in range(1, 101)],
+        "DELETE_EMPTY_FSM_STATE_SQL": (fsm_key,),
+        "CLEAR_FSM_STATE_SQL": (fsm_key,),
+        "SET_FSM_STATE_SQL": (fsm_key, "PaymentStates:waiting_for_payment"),
+        "DELETE_EMPTY_FSM_DATA_SQL": (fsm_key,),
+        "CLEAR_FSM_DATA_SQL": (fsm_key,),
+        "SET_FSM_DATA_SQL": (fsm_key, Json({"exchange": "Bybit"})),
+        "MERGE_FSM_DATA_SQL": (fsm_key, Json({"exchange": "Bybit"})),
+        "DELETE_STALE_FSM_STATES_SQL": (2419200.0, Json({"PaymentStates:waiting_for_payment": 2592000.0}), 2592000.0),
+        "COUNT_FSM_STATES_SQL": (),
+        "CLAIM_OUTBOX_SQL": (60.0, 100),
+        "RENEW_OUTBOX_SQL": (60.0, outbox_ids),
+        "COMPLETE_OUTBOX_SQL": (outbox_ids,),
+        "RETRY_OUTBOX_SQL": (5.0, outbox_ids[0]),
+        "FAIL_OUTBOX_SQL": (outbox_ids[0],),
+    }
+
+
+def seed_outbox(cursor, outbox: int):
+    # Доставленные строки удаляются, копятся только недоставленные (failed); ожидающих — ~1%.
+    cursor.execute(
+        """
+        INSERT INTO outbox (id, chat_id, text, status, next_attempt_at)
+        SELECT %(base)s + i, %(base)s + i, 'seed', CASE WHEN i %% 100 = 0 THEN 'pending' ELSE 'failed' END,
+               now() + (i %% 60) * interval '1 minute'
+        FROM generate_series(1, %(outbox)s) AS i
+        """,
+        {"base": SEED_BASE, "outbox": outbox}
+    )
+    cursor.execute("ANALYZE outbox")
+
+
+def expand(cursor, sql: str, params):
+    if isinstance(params, list):
+        values = ", ".join(cursor.mogrify("%s", (row,)).decode() for row in params)
+        return sql.replace("VALUES %s", "VALUES " + values), ()
+    return sql, params
+
+
+def scans(plan: dict):
+    if "Relation Name" in plan and plan["Node Type"] != "ModifyTable":
+        yield plan["Node Type"], plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from scans(child)
+
+
+async def run(args) -> int:
+    config = Config()
+    logger = Logger()
+    repo = Repository(config.db_config, logger, max_size=1)
+    await Migrator(repo, logger).migrate()
+    sqls = statements()
+    params = samples(args.users)
+
+    def work(cursor):
+        cursor.execute("SET LOCAL statement_timeout = 0")
+        started = time.perf_counter()
+        seed(cursor, args.users, args.payments, args.fsm_states)
+        seed_outbox(cursor, args.outbox)
+        print(f"seeded {args.users} users, {args.payments} payments, {args.fsm_states} fsm states, "
+              f"{args.outbox} outbox rows in {time.perf_counter() - started:.1f}s")
+        results = []
+        for name, sql in sqls.items():
+            if name not in params:
+                continue
+            sql, values = expand(cursor, sql, params[name])
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, values)
+            plan = cursor.fetchone()["QUERY PLAN"]
+            plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+            results.append((name, list(scans(plan))))
+        # Ничего из вставленного не сохраняется.
+        cursor.connection.rollback()
+        return results
+
+    try:
+        results = await repo._run(work)
+    finally:
+        await repo.close()
+
+    failed = 0
+    for name, nodes in results:
+        bad = [f"{node} on {table}" for node, table in nodes if table in TABLES and node not in INDEX_SCANS]
+        described = ", ".join(f"{node} on {table}" for node, table in nodes) or "no table scan"
+        print(f"{'FAIL' if bad else 'ok':4s} {name:32s} {described}")
+        failed += bool(bad)
+    problems = [f"{name:32s} no sample parameters" for name in sqls if name not in params]
+    problems += [f"{name:32s} sample for a missing constant" for name in params if name not in sqls]
+    problems += [f"{place:32s} SQL literal inside Repository, move it to a *_SQL constant" for place in inline_sql()]
+    for problem in problems:
+        print(f"FAIL {problem}")
+    print(f"{len(results) - failed}/{len(results)} queries use indexes")
+    return 1 if failed or problems else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка, что запросы Repository идут по индексам")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--payments", type=int, default=1000000)
+    parser.add_argument("--fsm-states", type=int, default=100000)
+    parser.add_argument("--outbox", type=int, default=100000)
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Локальный фейковый Crypto Pay API для разработки и нагрузочных прогонов.
+
+Запуск из каталога src:
+
+    python -m tools.fake_crypto_pay --port 8081 --latency 0.2 --pay-after 5
+
+Бот направляется на фейк через CRYPTO_PAY_API_URL=http://127.0.0.1:8081/api.
+Инвойс можно оплатить или просрочить вручную: POST /fake/pay/{invoice_id},
+POST /fake/expire/{invoice_id}. С --webhook-url
+фейк отправляет подписанный вебхук invoice_paid так же, как настоящий Crypto Pay
+(токен должен совпадать с CRYPTO_BOT_TOKEN бота).
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import time
+from datetime import datetime, timezone
+import aiohttp
+from aiohttp import web
+
+
+class FakeCryptoPay:
+    def __init__(self, token: str = None, latency: float = 0.0, jitter: float = 0.0,
+                 pay_after: float = None, failure_rate: float = 0.0, webhook_url: str = None):
+        self.token = token
+        self.webhook_url = webhook_url
+        self.webhook_tasks = set()
+        self.next_update_id = 1
+        self.latency = latency
+        self.jitter = jitter
+        self.pay_after = pay_after
+        self.failure_rate = failure_rate
+        self.invoices = {}
+        self.next_invoice_id = 1
+        self.requests = {}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/api/createInvoice", self.handle_create_invoice)
+        app.router.add_route("*", "/api/getInvoices", self.handle_get_invoices)
+        app.router.add_post("/fake/pay/{invoice_id}", self.handle_pay)
+        app.router.add_post("/fake/expire/{invoice_id}", self.handle_expire)
+        return app
+
+    async def _simulate(self, request: web.Request, method: str):
+        self.requests[method] = self.requests.get(method, 0) + 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.token and request.headers.get("Crypto-Pay-API-Token") != self.token:
+            raise web.HTTPUnauthorized(
+                text='{"ok": false, "error": {"code": 401, "name": "UNAUTHORIZED"}}',
+                content_type="application/json"
+            )
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise web.HTTPServiceUnavailable()
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def mark_paid(self, invoice_id: int) -> dict:
+        invoice = self.invoices[invoice_id]
+        if invoice["status"] == "active":
+            invoice["status"] = "paid"
+            invoice["paid_at"] = self._now()
+            if self.webhook_url:
+                task = asyncio.get_running_loop().create_task(self.send_webhook(invoice))
+                self.webhook_tasks.add(task)
+                task.add_done_callback(self.webhook_tasks.discard)
+        return invoice
+
+    def mark_expired(self, invoice_id: int) -> dict:
+        invoice = self.invoices[invoice_id]
+        if invoice["status"] == "active":
+            invoice["status"] = "expired"
+        return invoice
+
+    def sign(self, body: bytes) -> str:
+        secret = hashlib.sha256((self.token or "").encode()).digest()
+        return hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+    async def send_webhook(self, invoice: dict, url: str = None) -> int:
+        update = {
+            "update_id": self.next_update_id,
+            "update_type": "invoice_paid",
+            "request_date": self._now(),
+            "payload": self._public(invoice)
+        }
+        self.next_update_id += 1
+        body = json.dumps(update).encode()
+        headers = {"Content-Type": "application/json", "crypto-pay-api-signature": self.sign(body)}
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url or self.webhook_url, data=body, headers=headers) as response:
+                return response.status
+
+    def _refresh(self, invoice: dict) -> dict:
+        if (
+            invoice["status"] == "active"
+            and self.pay_after is not None
+            and time.monotonic() - invoice["_created"] >= self.pay_after
+        ):
+            self.mark_paid(invoice["invoice_id"])
+        return invoice
+
+    @staticmethod
+    def _public(invoice: dict) -> dict:
+        return {key: value for key, value in invoice.items() if not key.startswith("_")}
+
+    async def handle_create_invoice(self, request: web.Request) -> web.Response:
+        await self._simulate(request, "createInvoice")
+        params = request.query
+        invoice_id = self.next_invoice_id
+        self.next_invoice_id += 1
+        invoice = {
+            "invoice_id": invoice_id,
+            "hash": f"IV{invoice_id}",
+            "status": "active",
+            "asset": params.get("asset", "USDT"),
+            "amount": params.get("amount", "0"),
+            "description": params.get("description"),
+            "payload": params.get("payload"),
+            "pay_url": f"https://t.me/CryptoBot?start=IV{invoice_id}",
+            "bot_invoice_url": f"https://t.me/CryptoBot?start=IV{invoice_id}",
+            "created_at": self._now(),
+            "_created": time.monotonic()
+        }
+        self.invoices[invoice_id] = invoice
+        return web.json_response({"ok": True, "result": self._public(invoice)})
+
+    async def handle_get_invoices(self, request: web.Request) -> web.Response:
+        await self._simulate(request, "getInvoices")
+        params = request.query
+        if "invoice_ids" in params:
+            ids = [int(value) for value in params["invoice_ids"].split(",") if value]
+            items = [self.invoices[invoice_id] for invoice_id in ids if invoice_id in self.invoices]
+        else:
+            items = list(self.invoices.values())
+        items = [self._refresh(invoice) for invoice in items]
+        if "status" in params:
+            items = [invoice for invoice in items if invoice["status"] == params["status"]]
+        count = int(params.get("count", 100))
+        return web.json_response({"ok": True, "result": {"items": [self._public(i) for i in items[:count]]}})
+
+    async def handle_pay(self, request: web.Request) -> web.Response:
+        invoice_id = int(request.match_info["invoice_id"])
+        if invoice_id not in self.invoices:
+            raise web.HTTPNotFound()
+        return web.json_response({"ok": True, "result": self._public(self.mark_paid(invoice_id))})
+
+    async def handle_expire(self, request: web.Request) -> web.Response:
+        invoice_id = int(request.match_info["invoice_id"])
+        if invoice_id not in self.invoices:
+            raise web.HTTPNotFound()
+        return web.json_response({"ok": True, "result": self._public(self.mark_expired(invoice_id))})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Crypto Pay API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--token", default=None)
+    parser.add_argument("--latency", type=float, default=0.0, help="Базовая задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, с")
+    parser.add_argument("--pay-after", type=float, default=None, help="Автоматически оплачивать инвойс через N с")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Доля ответов 503")
+    parser.add_argument("--webhook-url", default=None, help="Куда слать подписанные вебхуки invoice_paid")
+    args = parser.parse_args()
+    fake = FakeCryptoPay(args.token, args.latency, args.jitter, args.pay_after, args.failure_rate, args.webhook_url)
+    web.run_app(fake.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Локальный фейковый Telegram Bot API для бенчмарков и нагрузочных прогонов.
+
+Отвечает на методы, которыми пользуется бот, считает вызовы и раздаёт
+подложенные обновления через getUpdates (long polling). Бот подключается к
+нему через make_bot().
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.updates = []
+        self.injected_at = {}
+        self.new_updates = asyncio.Event()
+        self.next_update_id = 1
+        self.next_message_id = 1
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def inject(self, update: dict) -> int:
+        update = dict(update, update_id=self.next_update_id)
+        self.next_update_id += 1
+        self.updates.append(update)
+        self.injected_at[update["update_id"]] = time.perf_counter()
+        self.new_updates.set()
+        return update["update_id"]
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        data = await request.post()
+        params = {}
+        for key, value in data.items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    def _message(self, params: dict) -> dict:
+        self.next_message_id += 1
+        chat_id = params.get("chat_id") or 1
+        return {
+            "message_id": params.get("message_id") or self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", "")
+        }
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = await self._params(request)
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        else:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if method == "getMe":
+                result = BOT_USER
+            elif method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+                result = self._message(params)
+            else:
+                result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+def make_bot(base_url: str, token: str = "42:FAKE") -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    return Bot(token=token, session=session)
+
+
+def message_update(user_id: int, text: str) -> dict:
+    return {
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User", "username": f"user{user_id}"},
+            "text": text,
+            **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}
+               if text.startswith("/") else {})
+        }
+    }
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {
+        "callback_query": {
+            "id": str(time.perf_counter_ns()),
+            "from": {"id": user_id, "is_bot": False, "first_name": "User", "username": f"user{user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu"
+            }
+        }
+    }
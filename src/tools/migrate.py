@@ -0,0 +1,40 @@
+"""Применение миграций схемы вручную (например, перед выкладкой с DB_MIGRATE_ON_START=false).
+
+Запуск из каталога src:
+
+    python -m tools.migrate            # применить недостающие миграции
+    python -m tools.migrate --check    # только проверить, ненулевой код выхода если схема устарела
+"""
+import argparse
+import asyncio
+from config.config import Config
+from logger.logger import Logger
+from repositories.db import Repository
+from repositories.migrator import Migrator
+
+
+async def run(args) -> int:
+    config = Config()
+    logger = Logger()
+    repo = Repository(config.db_config, logger, **config.db_pool_config)
+    migrator = Migrator(repo, logger)
+    try:
+        if args.check:
+            pending = await migrator.pending()
+            print(f"pending: {pending}" if pending else f"up to date (version {migrator.latest_version})")
+            return 1 if pending else 0
+        done = await migrator.migrate()
+        print(f"applied: {done}" if done else f"up to date (version {migrator.latest_version})")
+        return 0
+    finally:
+        await repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    parser.add_argument("--check", action="store_true", help="Только проверить, применены ли все миграции")
+    raise SystemExit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Нагрузочный прогон бота целиком: поток обновлений Telegram подаётся прямо в
+Handler.dp с заданной частотой и параллельностью, через все middleware,
+обработчики, Repository и CryptoService.
+
+Bot API и Crypto Pay заменены фейками (tools.fake_telegram, tools.fake_crypto_pay),
+которые работают в отдельном процессе, чтобы не делить event loop с ботом. База —
+настоящая (DB_*): синтетические пользователи и инвойсы лежат в диапазоне SEED_BASE
+и удаляются в конце. Запускать на отдельной базе.
+
+Поток синтезируется сценарием пользователя (/start, тип подписки, тариф, проверка
+оплаты, биржа, API-ключ) или читается из JSONL-файла (--replay) — по одному объекту
+Update на строку, например сохранённому из getUpdates. --record сохраняет
+синтезированный поток в такой же файл. Обновления одного пользователя
+обрабатываются строго по порядку, как их отдаёт Telegram.
+
+Печатает устойчивую пропускную способность, распределение задержки по
+обработчикам, задержку event loop и число вызовов Bot API и Crypto Pay.
+--max-api-calls задаёт бюджет вызовов Bot API на одно обновление: при превышении
+прогон завершается с ненулевым кодом, так что его можно ставить в CI.
+
+Запуск из каталога src:
+
+    python -m tools.replay_load --users 500 --rate 300 --concurrency 50
+    python -m tools.replay_load --users 1000 --record updates.jsonl
+    python -m tools.replay_load --replay updates.jsonl --rate 0
+    python -m tools.replay_load --users 200 --rate 0 --max-api-calls 1.7
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import time
+from collections import Counter, defaultdict
+from aiohttp import web
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+from config.config import Config
+from handlers.bot import Handler
+from logger.logger import Logger
+from metrics.metrics import LoopLagMonitor
+from repositories.db import Repository
+from repositories.fsm_storage import ExpiringMemoryStorage, PostgresStorage
+from repositories.migrator import Migrator
+from repositories.user_cache import UserCache
+from repositories.username_buffer import UsernameBuffer
+from services.bot_service import BotService
+from services.crypto_service import CryptoService
+from services.expiry_scheduler import ExpiryScheduler
+from services.notifier import Notifier
+from services.outbox import Outbox
+from services.tariff_catalog import TariffCatalog
+from tools.fake_crypto_pay import FakeCryptoPay
+from tools.fake_telegram import FakeTelegram, make_bot, message_update, callback_update
+from tools.seed import SEED_BASE, cleanup
+from tools.stats import summarize, format_summary
+
+SCENARIO = [
+    lambda user_id, args: message_update(user_id, "/start"),
+    lambda user_id, args: callback_update(user_id, f"subscription_type:{args.subscription_type}"),
+    lambda user_id, args: callback_update(user_id, f"tariff:{args.tariff}"),
+    lambda user_id, args: callback_update(user_id, f"check_payment:{args.tariff}"),
+    lambda user_id, args: callback_update(user_id, f"exchange:{args.exchange}"),
+    lambda user_id, args: message_update(user_id, f"replay-api-key-{user_id}")
+]
+
+
+def synthesize(args) -> list[dict]:
+    # Шаги идут по кругу между пользователями: соседние обновления одного
+    # пользователя разнесены на --users позиций, как у живых людей между нажатиями.
+    user_ids = [SEED_BASE + index for index in range(1, args.users + 1)]
+    updates = []
+    for step in SCENARIO:
+        for user_id in user_ids:
+            updates.append(dict(step(user_id, args), update_id=len(updates) + 1))
+    return updates
+
+
+def load(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def record(path: str, updates: list[dict]):
+    with open(path, "w", encoding="utf-8") as f:
+        for update in updates:
+            f.write(json.dumps(update, ensure_ascii=False) + "\n")
+
+
+def classify(update: dict) -> str:
+    if "callback_query" in update:
+        return (update["callback_query"].get("data") or "").split(":")[0]
+    if "message" in update:
+        text = update["message"].get("text") or ""
+        return text.split()[0] if text.startswith("/") else "text"
+    return next((key for key in update if key != "update_id"), "unknown")
+
+
+def sender(update: dict) -> int:
+    for event in update.values():
+        if isinstance(event, dict) and "from" in event:
+            return event["from"]["id"]
+    return 0
+
+
+async def serve_fakes(args, stop, results):
+    telegram = FakeTelegram(latency=args.api_latency)
+    crypto_pay = FakeCryptoPay(latency=args.crypto_latency, pay_after=args.pay_after)
+    # Номера инвойсов из диапазона засеянных данных, чтобы cleanup() удалил и их.
+    crypto_pay.next_invoice_id = SEED_BASE + 1
+    runners = []
+    for app, port in ((telegram.create_app(), args.port), (crypto_pay.create_app(), args.port + 1)):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        runners.append(runner)
+    while not stop.is_set():
+        await asyncio.sleep(0.1)
+    results.put({"telegram": dict(telegram.calls), "crypto_pay": dict(crypto_pay.requests)})
+    for runner in runners:
+        await runner.cleanup()
+
+
+def fakes_process(args, stop, results):
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(serve_fakes(args, stop, results))
+
+
+async def replay(handler: Handler, updates: list[dict], rate: float, concurrency: int) -> tuple[dict, Counter, float]:
+    latencies = defaultdict(list)
+    errors = Counter()
+    slots = asyncio.Semaphore(concurrency)
+    # asyncio.Lock будит ожидающих по очереди, так что порядок обновлений пользователя сохраняется.
+    user_locks = defaultdict(asyncio.Lock)
+    tasks = set()
+
+    async def feed(raw: dict):
+        name = classify(raw)
+        try:
+            async with user_locks[sender(raw)]:
+                update = Update.model_validate(raw, context={"bot": handler.bot})
+                started = time.perf_counter()
+                try:
+                    await handler.dp.feed_update(handler.bot, update)
+                except Exception:
+                    errors[name] += 1
+                finally:
+                    latencies[name].append(time.perf_counter() - started)
+        finally:
+            slots.release()
+
+    started = time.perf_counter()
+    for index, raw in enumerate(updates):
+        if rate:
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # Слот берётся до запуска задачи: при насыщении генератор отстаёт от --rate,
+        # и измеренная пропускная способность остаётся устойчивой, а не размером очереди.
+        await slots.acquire()
+        task = asyncio.create_task(feed(raw))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    return latencies, errors, time.perf_counter() - started
+
+
+async def create_storage(args, repo: Repository, logger: Logger):
+    if args.fsm == "postgres":
+        return PostgresStorage(repo, logger)
+    return ExpiringMemoryStorage(logger)
+
+
+async def run(args):
+    config = Config()
+    logger = Logger()
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.replay:
+        updates = load(args.replay)
+    else:
+        updates = synthesize(args)
+    if args.record:
+        record(args.record, updates)
+        print(f"{len(updates)} updates written to {args.record}")
+
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=fakes_process, args=(args, stop, results))
+    process.start()
+
+    repo = Repository(config.db_config, logger, max_size=args.pool_size,
+                      user_cache=UserCache() if args.user_cache else None)
+    await Migrator(repo, logger).migrate()
+    await repo._run(cleanup)
+    tariffs = TariffCatalog(config.tariffs_path, logger)
+    bot = make_bot(f"http://127.0.0.1:{args.port}")
+    crypto_service = CryptoService("fake", logger, api_url=f"http://127.0.0.1:{args.port + 1}/api",
+                                   max_concurrency=args.crypto_concurrency)
+    outbox = Outbox(repo, Notifier(bot, logger, per_chat_burst=3), logger)
+    outbox_task = asyncio.create_task(outbox.run())
+    bot_service = BotService(repo, crypto_service, tariffs, logger, ExpiryScheduler(repo, logger), outbox)
+    username_buffer = UsernameBuffer(repo, logger)
+    storage = await create_storage(args, repo, logger)
+    handler = Handler(bot, bot_service, logger, username_buffer, storage)
+    await asyncio.sleep(args.warmup)
+
+    monitor = LoopLagMonitor(0.01, max_samples=1000000)
+    monitor_task = asyncio.create_task(monitor.run())
+    try:
+        latencies, errors, elapsed = await replay(handler, updates, args.rate, args.concurrency)
+    finally:
+        monitor_task.cancel()
+        # Ответы уходят через outbox: ждём, пока он разберётся, чтобы сосчитать все вызовы Bot API.
+        # Подтверждения оплаты лежат в таблице outbox — забираем их, не дожидаясь опроса.
+        await outbox._claim()
+        await outbox.close(timeout=60)
+        outbox_task.cancel()
+        if isinstance(storage, PostgresStorage):
+            keys = {StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id) for user_id in map(sender, updates)}
+            await storage.set_many({key: (None, {}) for key in keys})
+        await storage.close()
+        await username_buffer.close()
+        await crypto_service.close()
+        await bot.session.close()
+        await repo._run(cleanup)
+        await repo.close()
+        stop.set()
+    calls = await asyncio.get_running_loop().run_in_executor(None, results.get)
+    await asyncio.get_running_loop().run_in_executor(None, process.join)
+
+    print(format_summary("all updates", summarize([value for values in latencies.values() for value in values], elapsed)))
+    for name, values in sorted(latencies.items()):
+        print(f"{format_summary(name, summarize(values))} errors={errors[name]}")
+    print(format_summary("event loop lag", summarize(monitor.samples)))
+    api_calls = sum(count for method, count in calls["telegram"].items() if method != "getMe")
+    per_update = api_calls / max(len(updates), 1)
+    print(f"Bot API calls: {api_calls} ({per_update:.2f}/update) {calls['telegram']}")
+    print(f"Crypto Pay requests: {calls['crypto_pay']}")
+    if args.max_api_calls is not None and per_update > args.max_api_calls:
+        raise SystemExit(f"Bot API calls per update {per_update:.2f} exceed --max-api-calls {args.max_api_calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обновлений через Handler.dp")
+    parser.add_argument("--users", type=int, default=500, help="Синтетических пользователей, каждый проходит сценарий целиком")
+    parser.add_argument("--rate", type=float, default=200.0, help="Обновлений в секунду (0 — без ограничения)")
+    parser.add_argument("--concurrency", type=int, default=50, help="Одновременно обрабатываемых обновлений")
+    parser.add_argument("--replay", help="JSONL-файл с обновлениями вместо синтетического сценария")
+    parser.add_argument("--record", help="Сохранить поток обновлений в JSONL-файл")
+    parser.add_argument("--subscription-type", default="regular")
+    parser.add_argument("--tariff", default="1month")
+    parser.add_argument("--exchange", default="Bybit")
+    parser.add_argument("--fsm", default="expiring", choices=["expiring", "postgres"])
+    parser.add_argument("--user-cache", action="store_true", help="Включить UserCache")
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--crypto-concurrency", type=int, default=10)
+    parser.add_argument("--api-latency", type=float, default=0.03, help="Задержка фейкового Bot API, с")
+    parser.add_argument("--crypto-latency", type=float, default=0.1, help="Задержка фейкового Crypto Pay, с")
+    parser.add_argument("--pay-after", type=float, default=0.0, help="Фейк считает инвойс оплаченным через N с")
+    parser.add_argument("--port", type=int, default=8097, help="Порт фейкового Bot API; Crypto Pay — на следующем")
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--max-api-calls", type=float, help="Бюджет вызовов Bot API на обновление (без getMe)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Заполнение базы синтетическими данными для бенчмарков и проверки планов запросов.
+Все строки лежат в отдельном диапазоне ID (от SEED_BASE) и удаляются cleanup().
+"""
+
+SEED_BASE = 9 * 10 ** 12
+# Все засеянные платежи — за тариф SEED_TARIFF по цене из config/tariffs.json для типа подписки
+# пользователя, чтобы подтверждение оплаты находило тариф и по payload, и по сумме.
+SEED_TARIFF = "1month"
+SEED_PRICES = {"regular": 70, "referral": 35}
+
+
+def seed(cursor, users: int, payments: int, fsm_states: int):
+    # Почти все подписки активны, просрочена ~0.1% — как в живой базе, где истёкших сразу удаляют.
+    cursor.execute(
+        """
+        INSERT INTO users (user_id, subscription_end, username, is_referral, subscription_type)
+        SELECT %(base)s + i,
+               CASE WHEN i %% 1000 = 0 THEN now() - interval '1 hour' ELSE now() + (i %% 365) * interval '1 day' END,
+               'seed_' || i, i %% 10 = 0, CASE WHEN i %% 10 = 0 THEN 'referral' ELSE 'regular' END
+        FROM generate_series(1, %(users)s) AS i
+        """,
+        {"base": SEED_BASE, "users": users}
+    )
+    # ~1% платежей ещё не оплачены, остальные оплачены или просрочены.
+    cursor.execute(
+        """
+        INSERT INTO payments (invoice_id, user_id, amount, currency, status, tariff_id, created_at, idempotency_key)
+        SELECT %(base)s + i, %(base)s + 1 + (i %% %(users)s),
+               CASE WHEN (1 + i %% %(users)s) %% 10 = 0 THEN %(referral)s ELSE %(regular)s END, 'USDT',
+               CASE WHEN i %% 100 = 0 THEN 'created' WHEN i %% 100 < 5 THEN 'expired' ELSE 'paid' END,
+               %(tariff)s, now() - (i %% 720) * interval '1 hour',
+               CASE WHEN i %% 100 = 0 THEN 'seed:' || i END
+        FROM generate_series(1, %(payments)s) AS i
+        """,
+        {"base": SEED_BASE, "users": users, "payments": payments, "tariff": SEED_TARIFF,
+         "regular": SEED_PRICES["regular"], "referral": SEED_PRICES["referral"]}
+    )
+    cursor.execute(
+        """
+        INSERT INTO fsm_states (key, state, data, updated_at)
+        SELECT 'fsm:seed:' || i, 'PaymentStates:waiting_for_payment', '{"exchange": "Bybit"}'::jsonb,
+               now() - (i %% 43200) * interval '1 minute'
+        FROM generate_series(1, %(fsm_states)s) AS i
+        """,
+        {"fsm_states": fsm_states}
+    )
+    cursor.execute("ANALYZE users")
+    cursor.execute("ANALYZE payments")
+    cursor.execute("ANALYZE fsm_states")
+
+
+def seeded_payment(invoice_id: int, users: int) -> tuple[int, str, str]:
+    # Пользователь, тип подписки и статус засеянного платежа — по тем же формулам, что в seed().
+    i = invoice_id - SEED_BASE
+    index = 1 + i % users
+    subscription_type = "referral" if index % 10 == 0 else "regular"
+    status = "created" if i % 100 == 0 else "expired" if i % 100 < 5 else "paid"
+    return SEED_BASE + index, subscription_type, status
+
+
+def last_invoice_id(user_id: int, users: int, payments: int) -> int:
+    # Самый поздний засеянный платеж пользователя (None, если платежей у него нет).
+    remainder = user_id - SEED_BASE - 1
+    i = remainder + (payments - remainder) // users * users
+    return SEED_BASE + i if 0 < i <= payments else None
+
+
+def cleanup(cursor):
+    cursor.execute("DELETE FROM payments WHERE invoice_id > %s", (SEED_BASE,))
+    cursor.execute("DELETE FROM users WHERE user_id > %s", (SEED_BASE,))
+    cursor.execute("DELETE FROM fsm_states WHERE key LIKE 'fsm:seed:%%'")
@@ -0,0 +1,31 @@
+import statistics
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values: list[float], elapsed: float = None) -> dict:
+    summary = {
+        "count": len(values),
+        "mean_ms": statistics.fmean(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": max(values) * 1000 if values else 0.0
+    }
+    if elapsed:
+        summary["throughput"] = len(values) / elapsed
+    return summary
+
+
+def format_summary(name: str, summary: dict) -> str:
+    parts = [f"{name:32s}", f"n={summary['count']}"]
+    if "throughput" in summary:
+        parts.append(f"{summary['throughput']:.0f}/s")
+    parts += [f"p50={summary['p50_ms']:.2f}ms", f"p95={summary['p95_ms']:.2f}ms", f"p99={summary['p99_ms']:.2f}ms"]
+    return " ".join(parts)
@@ -0,0 +1,111 @@
+import asyncio
+import random
+from collections import Counter
+from typing import Callable
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, TelegramMethod
+
+
+class StubBot:
+    def __init__(self, latency: float = 0.0, retry_after_rate: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.calls["send_message"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.retry_after_rate and random.random() < self.retry_after_rate:
+            raise TelegramRetryAfter(
+                method=SendMessage(chat_id=chat_id, text=text),
+                message="Too Many Requests",
+                retry_after=self.retry_after
+            )
+
+
+class StubSession(BaseSession):
+    # Сессия aiogram без сети: считает вызовы Bot API по имени метода (sendMessage,
+    # editMessageText, answerCallbackQuery...). Ответы Bot API бот не разбирает, поэтому хватает True.
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int = None):
+        self.calls[method.__api_method__] += 1
+        return True
+
+    async def stream_content(self, url: str, headers: dict = None, timeout: int = 30, chunk_size: int = 65536,
+                             raise_for_status: bool = True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class StubCryptoService:
+    def __init__(self, latency: float = 0.0, status: str = "active", invoice_fields: Callable[[int], dict] = None):
+        # invoice_fields(invoice_id) подменяет поля инвойса (amount, payload) — например,
+        # под платежи, засеянные tools.seed.
+        self.latency = latency
+        self.status = status
+        self.invoice_fields = invoice_fields
+        self.calls = Counter()
+        self.next_invoice_id = 1
+
+    async def _wait(self, method: str):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _invoice(self, invoice_id: int, amount: float = 70, payload: str = None) -> dict:
+        invoice = {
+            "invoice_id": invoice_id,
+            "status": self.status,
+            "amount": str(amount),
+            "payload": payload,
+            "pay_url": f"https://t.me/CryptoBot?start=IV{invoice_id}"
+        }
+        if self.invoice_fields is not None:
+            invoice.update(self.invoice_fields(invoice_id))
+        return invoice
+
+    async def create_invoice(self, user_id: int, amount: float, description: str, expires_in: int = None,
+                             payload: str = None) -> dict:
+        await self._wait("create_invoice")
+        self.next_invoice_id += 1
+        return {"ok": True, "result": self._invoice(self.next_invoice_id, amount, payload or f"user_{user_id}")}
+
+    async def check_invoice(self, invoice_id: int) -> dict:
+        await self._wait("check_invoice")
+        return {"ok": True, "result": {"items": [self._invoice(invoice_id)]}}
+
+    async def get_invoices(self, invoice_ids: list[int]) -> dict:
+        await self._wait("get_invoices")
+        return {"ok": True, "result": {"items": [self._invoice(invoice_id) for invoice_id in invoice_ids]}}
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def remember_invoice(self, invoice: dict):
+        pass
+
+    async def close(self):
+        pass
+
+
+class StubOutbox:
+    # Outbox без отправки: BotService только будит его после записи в таблицу outbox.
+    def __init__(self):
+        self.calls = Counter()
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        self.calls["send"] += 1
+        return True
+
+    def wake(self):
+        self.calls["wake"] += 1